@@ -0,0 +1,65 @@
+# activity_index.py
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+class ActivityIndex:
+    # Persistent per-route index of activity metadata, one SQLite row per .act keyed on its ACTIVITIES folder and
+    # file name. Rows are written individually, so caching one activity's details never rewrites the rest, and
+    # separate parsers (global cleanup, verify) share the same rows instead of overwriting each other's copies.
+    # Files without a Name are stored as negative entries (entry NULL), so they are not re-read on every scan.
+    def __init__(self, db_file="activity_index.db", log_callback=print):
+        self.db_path = Path(db_file); self.log = log_callback
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                with conn: conn.execute("CREATE TABLE IF NOT EXISTS activities (folder TEXT NOT NULL, name TEXT NOT NULL, mtime INTEGER NOT NULL, size INTEGER NOT NULL, entry TEXT, details TEXT, PRIMARY KEY (folder, name))")
+        except sqlite3.Error as e: self.log(f"[ERROR] Could not open activity index: {e}")
+
+    def _connect(self):
+        return sqlite3.connect(str(self.db_path), timeout=10)
+
+    @staticmethod
+    def _row_to_entry(mtime, size, entry, details):
+        result = json.loads(entry) if entry else {"missing_name": True}
+        result["mtime"] = mtime; result["size"] = size
+        if details: result["details"] = json.loads(details)
+        return result
+
+    def folder_entries(self, folder):
+        # {file name: entry} for one ACTIVITIES folder; negative entries carry "missing_name".
+        try:
+            with closing(self._connect()) as conn:
+                rows = conn.execute("SELECT name, mtime, size, entry, details FROM activities WHERE folder = ?", (str(folder),)).fetchall()
+        except sqlite3.Error as e: self.log(f"[ERROR] Could not read activity index: {e}"); return {}
+        return {name: self._row_to_entry(mtime, size, entry, details) for name, mtime, size, entry, details in rows}
+
+    def get(self, folder, name):
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute("SELECT mtime, size, entry, details FROM activities WHERE folder = ? AND name = ?", (str(folder), name)).fetchone()
+        except sqlite3.Error as e: self.log(f"[ERROR] Could not read activity index: {e}"); return None
+        return self._row_to_entry(*row) if row else None
+
+    def update_folder(self, folder, changed, removed):
+        # changed: {name: (mtime, size, entry or None)}; removed: names no longer on disk. One transaction per scan.
+        if not changed and not removed: return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany("INSERT OR REPLACE INTO activities (folder, name, mtime, size, entry, details) VALUES (?, ?, ?, ?, ?, NULL)",
+                                 [(str(folder), name, mtime, size, json.dumps(entry) if entry is not None else None) for name, (mtime, size, entry) in changed.items()])
+                conn.executemany("DELETE FROM activities WHERE folder = ? AND name = ?", [(str(folder), name) for name in removed])
+        except sqlite3.Error as e: self.log(f"[ERROR] Could not write activity index: {e}")
+
+    def set_details(self, folder, name, mtime, size, details):
+        # Only caches against a row that still describes the file the details were read from.
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("UPDATE activities SET details = ? WHERE folder = ? AND name = ? AND mtime = ? AND size = ?", (json.dumps(details), str(folder), name, mtime, size))
+        except sqlite3.Error as e: self.log(f"[ERROR] Could not write activity index: {e}")
+
+    def forget(self, folder, name):
+        try:
+            with closing(self._connect()) as conn, conn: conn.execute("DELETE FROM activities WHERE folder = ? AND name = ?", (str(folder), name))
+        except sqlite3.Error as e: self.log(f"[ERROR] Could not write activity index: {e}")
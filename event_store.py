@@ -0,0 +1,95 @@
+# event_store.py
+import bisect
+import time
+
+class ManualEvent:
+    # One row of the manual editor in the units its table shows: overcast %, fog in metres, precipitation mm/h.
+    __slots__ = ("time", "overcast", "fog", "precip", "liquidity", "transition", "sound")
+    FIELDS = __slots__
+
+    def __init__(self, time, overcast, fog, precip, liquidity, transition, sound="None"):
+        self.time = time; self.overcast = overcast; self.fog = fog; self.precip = precip
+        self.liquidity = liquidity; self.transition = transition; self.sound = sound or "None"
+
+    @classmethod
+    def from_values(cls, values):
+        # Accepts typed values or the strings older presets and Treeview rows hold ("1800", "2.0", ...).
+        time_s, overcast, fog, precip, liquidity, transition = values[:6]
+        sound = values[6] if len(values) > 6 else "None"
+        return cls(int(float(time_s)), int(float(overcast)), int(float(fog)), float(precip), float(liquidity), int(float(transition)), sound)
+
+    def as_tuple(self):
+        return (self.time, self.overcast, self.fog, self.precip, self.liquidity, self.transition, self.sound)
+
+    def replace(self, **changes):
+        values = dict(zip(self.FIELDS, self.as_tuple())); values.update(changes)
+        return ManualEvent(**values)
+
+class EventStore:
+    # The manual editor's events kept sorted by time (ties in insertion order). Each event has a stable key, which
+    # the editor also uses as its Treeview item id, so the table and timeline are views over this store.
+    def __init__(self):
+        self._order = [] # Sorted (time, key) pairs
+        self._events = {} # key -> ManualEvent
+        self._next_key = 0
+
+    def __len__(self): return len(self._order)
+    def __iter__(self): return (self._events[key] for _, key in self._order)
+    def __contains__(self, key): return key in self._events
+
+    def keys(self): return [key for _, key in self._order]
+    def items(self): return [(key, self._events[key]) for _, key in self._order]
+    def get(self, key): return self._events[key]
+    def index(self, key): return bisect.bisect_left(self._order, (self._events[key].time, key))
+    def first(self): return self._events[self._order[0][1]] if self._order else None
+    def last(self): return self._events[self._order[-1][1]] if self._order else None
+
+    def neighbours(self, key):
+        # (previous, next) events around key in time order; either may be None.
+        i = self.index(key)
+        return (self._events[self._order[i - 1][1]] if i > 0 else None, self._events[self._order[i + 1][1]] if i + 1 < len(self._order) else None)
+
+    def add(self, event):
+        # Returns (key, index) of the new event.
+        key = f"E{self._next_key:08d}"; self._next_key += 1 # Zero-padded so ties sort in insertion order
+        self._events[key] = event
+        entry = (event.time, key); index = bisect.bisect_left(self._order, entry); self._order.insert(index, entry)
+        return key, index
+
+    def replace(self, key, event):
+        # Returns the event's new index; only re-sorts when its time changed.
+        old = self._events[key]
+        if old.time == event.time: self._events[key] = event; return self.index(key)
+        del self._order[self.index(key)]
+        self._events[key] = event
+        entry = (event.time, key); index = bisect.bisect_left(self._order, entry); self._order.insert(index, entry)
+        return index
+
+    def move(self, key, new_time):
+        return self.replace(key, self._events[key].replace(time=new_time))
+
+    def remove(self, key):
+        del self._order[self.index(key)]; del self._events[key]
+
+    def clear(self):
+        self._order.clear(); self._events.clear()
+
+    def snapshot(self):
+        # Immutable copy of the sequence for background work.
+        return tuple(event.as_tuple() for event in self)
+
+def benchmark_edits(event_count=5000, repeat=3):
+    # Micro-benchmark: builds a sequence, then moves every event as a timeline drag would.
+    best = None
+    for _ in range(repeat):
+        store = EventStore(); start = time.perf_counter()
+        keys = [store.add(ManualEvent((i * 7919) % (event_count * 60), 50, 10000, 1.0, 1.0, 60))[0] for i in range(event_count)]
+        for i, key in enumerate(keys): store.move(key, store.get(key).time + (i % 120) - 60)
+        snapshot = store.snapshot(); elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert [e[0] for e in snapshot] == sorted(e[0] for e in snapshot)
+    print(f"Inserted and moved {event_count} events in {best * 1000:.1f} ms")
+    return best
+
+if __name__ == "__main__":
+    benchmark_edits()
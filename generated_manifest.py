@@ -0,0 +1,94 @@
+# generated_manifest.py
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+_lock = threading.Lock()
+
+# Records every file WeatherLink writes into a content folder, so cleanup and status checks never walk the disk.
+class GeneratedFilesManifest:
+    def __init__(self, manifest_file="generated_files.json", log_callback=print):
+        self.manifest_path = Path(manifest_file); self.log = log_callback
+        self._cache = {}; self._cache_stamp = None
+        self._pending = []; self._batch_depth = 0 # Records not yet written; writes are deferred while a batch is open
+
+    @staticmethod
+    def _key(path): return os.path.normcase(os.path.abspath(str(path)))
+
+    @staticmethod
+    def content_root_for(route_path):
+        parts = Path(route_path).parts; upper = [p.upper() for p in parts]
+        if "ROUTES" in upper and upper.index("ROUTES") > 0: return Path(*parts[:upper.index("ROUTES")])
+        return Path(route_path)
+
+    def _read(self):
+        try: stat = self.manifest_path.stat()
+        except OSError: self._cache, self._cache_stamp = {}, None; return self._cache
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self._cache_stamp:
+            try:
+                with open(self.manifest_path, 'r') as f: self._cache = json.load(f)
+            except (json.JSONDecodeError, OSError): self._cache = {}
+            self._cache_stamp = stamp
+            for key, kind, file_path in self._pending: self._apply(self._cache, key, kind, file_path) # Keep unflushed records
+        return self._cache
+
+    def _write(self, data):
+        try:
+            with open(self.manifest_path, 'w') as f: json.dump(data, f, separators=(',', ':'))
+            stat = self.manifest_path.stat(); self._cache, self._cache_stamp = data, (stat.st_mtime_ns, stat.st_size)
+            self._pending.clear()
+        except OSError as e: self.log(f"[ERROR] Could not write generated files manifest: {e}")
+
+    def is_tracked(self, content_path):
+        # True once the content folder has had its one full scan (replace()). Folders that only have record()ed
+        # files are not tracked yet, since files from before the manifest existed may still be on disk.
+        with _lock: return self._read().get(self._key(content_path), {}).get("scanned", False)
+
+    @staticmethod
+    def _apply(data, key, kind, file_path):
+        files = data.setdefault(key, {}).setdefault(kind, [])
+        if file_path in files: return False
+        files.append(file_path); return True
+
+    def record(self, content_path, kind, file_path):
+        with _lock:
+            entry = (self._key(content_path), kind, str(file_path))
+            if self._apply(self._read(), *entry):
+                self._pending.append(entry)
+                if not self._batch_depth: self._write(self._cache)
+
+    @contextmanager
+    def batch(self):
+        # Defers the writes of every record() inside the block to one write at its end (e.g. once per generation).
+        with _lock: self._batch_depth += 1
+        try: yield self
+        finally:
+            with _lock:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._pending: self._write(self._read())
+
+    def get_files(self, content_path, kind, under=None):
+        with _lock: files = list(self._read().get(self._key(content_path), {}).get(kind, []))
+        if under is None: return [Path(f) for f in files]
+        prefix = self._key(under) + os.sep
+        return [Path(f) for f in files if self._key(f).startswith(prefix)]
+
+    def all_files(self, kind):
+        with _lock: return [Path(f) for entry in self._read().values() for f in entry.get(kind, [])]
+
+    def forget(self, content_path, kind, file_paths):
+        if not file_paths: return
+        with _lock:
+            data = self._read(); entry = data.get(self._key(content_path), {})
+            removed = {str(f) for f in file_paths}
+            entry[kind] = [f for f in entry.get(kind, []) if f not in removed]; self._write(data)
+
+    def replace(self, content_path, files_by_kind):
+        with _lock:
+            data = self._read()
+            data[self._key(content_path)] = {kind: sorted(str(f) for f in files) for kind, files in files_by_kind.items()}
+            data[self._key(content_path)]["scanned"] = True
+            self._write(data)
@@ -5,7 +5,6 @@ import threading
 from pathlib import Path
 import sv_ttk
 import sys
-import re
 from datetime import datetime
 import json
 import traceback
@@ -22,6 +21,7 @@ from weather_service import WeatherService
 from sound_manager import SoundManager
 from ui_components import AboutWindow, ForecastChart, DateSelectionWindow, TKCALENDAR_AVAILABLE, SettingsWindow, Tooltip, StartupInfoWindow
 from manual_editor import ManualWeatherEditor
+from weather_events import parse_weather_event
 
 try:
     from tkintermapview import TkinterMapView
@@ -46,6 +46,8 @@ class MainApplication(tk.Tk):
         self.shutdown_event = threading.Event()
         self.weather = WeatherService(self._log_to_widget_from_thread)
         self.sound_manager = SoundManager(self._log_to_widget_from_thread)
+        self.sound_manager.compact_sounds = self.config.get('compact_sounds')
+        self.sound_manager.render_ambient_loops = self.config.get('render_ambient_loops')
         self.current_route_data = {}
         self.current_activities = {}
         self.selected_activity_path = None
@@ -56,6 +58,7 @@ class MainApplication(tk.Tk):
         self.raw_forecast_list = []
         self.weather_fetch_points = []
         self.path_dist = 0
+        self.path_geometry = None
         self.title("ORTS WeatherLink")
         self.geometry(self.config.get('window_geometry'))
         self.logo_original_img = None
@@ -306,6 +309,7 @@ class MainApplication(tk.Tk):
         self.log("[Info] Closing application...")
         self.config.set('window_geometry', self.geometry())
         self.shutdown_event.set()
+        self.sound_manager.stop()
         self.map_widget.destroy()
         self.destroy()
 
@@ -489,14 +493,18 @@ class MainApplication(tk.Tk):
 
             self.activity_details = self.parser.get_activity_details(self.selected_activity_path)
             if not self.shutdown_event.is_set(): self.after(0, lambda: self.update_details_text(self.activity_details))
-            path_coords, self.path_dist = self.parser.get_activity_path_coords(route_info['path'], self.activity_details['path_id'])
-            if path_coords:
-                self.path_coords_cache = path_coords
+            self.path_geometry = self.parser.get_activity_path_geometry(route_info['path'], self.activity_details['path_id'])
+            if self.path_geometry:
+                # The map gets a detailed outline; weather sampling keeps its coarse ~100-point budget.
+                map_coords = self.path_geometry.simplified_coords(tolerance_m=5.0, max_points=2000)
+                path_coords = self.path_geometry.simplified_coords(tolerance_m=25.0, max_points=100)
+                self.path_coords_cache = path_coords; self.path_dist = self.path_geometry.total_dist
                 self.found_coords = path_coords[0][0]
-                if not self.shutdown_event.is_set(): self.after(0, lambda: self._update_map_with_path(path_coords))
+                self.log(f"[Info] Map path uses {len(map_coords)} of {len(self.path_geometry)} nodes.")
+                if not self.shutdown_event.is_set(): self.after(0, lambda: self._update_map_with_path(map_coords))
                 if not self.shutdown_event.is_set(): self.update_weather_info(self.found_coords[0], self.found_coords[1], route_info)
             else:
-                self.path_coords_cache = None; lat, lon = self.parser.find_route_start_location(route_info); self.found_coords = (lat, lon)
+                self.path_coords_cache = None; self.path_dist = 0; lat, lon = self.parser.find_route_start_location(route_info); self.found_coords = (lat, lon)
                 if lat is not None:
                     if not self.shutdown_event.is_set(): self.after(0, lambda: self._update_map_with_start_point(lat, lon))
                     if not self.shutdown_event.is_set(): self.update_weather_info(lat, lon, route_info)
@@ -542,30 +550,24 @@ class MainApplication(tk.Tk):
         self.existing_weather_human.insert('', 'end', values=("Activity Season", f"{seasons.get(details['season'], 'Unknown')} ({details['season']})"))
         self.existing_weather_human.insert('', 'end', values=("─" * 25, "─" * 25))
         for event_index, event_block in enumerate(details['existing_weather']):
-            time_match = re.search(r'Time\s*\(\s*(\d+)\s*\)', event_block)
-            time_val = int(time_match.group(1)) if time_match else 'N/A'
-            name_match = re.search(r'Name\s*\(\s*([^)]+)\s*\)', event_block)
-            event_name = name_match.group(1).strip() if name_match else f'Weather Event #{event_index + 1}'
-            def get_orts_param(name):
-                pattern = fr'{name}\s*\(\s*([\d\.-]+)(?:\s+([\d\.-]+))?\s*\)'
-                match = re.search(pattern, event_block, re.IGNORECASE)
-                if match: return match.group(1), (match.group(2) if match.group(2) else None)
-                return None, None
-            overcast, overcast_duration = get_orts_param('ORTSOvercast')
-            fog, fog_duration = get_orts_param('ORTSFog')
-            precip, precip_duration = get_orts_param('ORTSPrecipitationIntensity')
-            liquid, liquid_duration = get_orts_param('ORTSPrecipitationLiquidity')
-            if time_val != 'N/A':
+            event = parse_weather_event(event_block)
+            time_val = event.time if event else None
+            event_name = event.name if event and event.name else f'Weather Event #{event_index + 1}'
+            overcast, overcast_duration = (event.overcast, event.overcast_transition) if event else (None, None)
+            fog, fog_duration = (event.fog, event.fog_transition) if event else (None, None)
+            precip, precip_duration = (event.precip, event.precip_transition) if event else (None, None)
+            liquid, liquid_duration = (event.liquidity, event.liquidity_transition) if event else (None, None)
+            if time_val is not None:
                 h, m, s = time_val // 3600, (time_val % 3600) // 60, time_val % 60
                 self.existing_weather_human.insert('', 'end', values=(f"⏰ TIME: {h:02d}:{m:02d}:{s:02d}", f"{time_val}s"))
                 self.existing_weather_human.insert('', 'end', values=(f"📝 EVENT: {event_name}", ""))
-                if overcast: self.existing_weather_human.insert('', 'end', values=("☁️  Cloud Cover", f"{float(overcast) * 100:.0f}%" + (f" (transition: {overcast_duration}s)" if overcast_duration else "")))
-                if fog: self.existing_weather_human.insert('', 'end', values=("👁️  Visibility", f"{float(fog) / 1000.0:.1f} km" + (f" (transition: {fog_duration}s)" if fog_duration else "")))
-                if precip:
+                if overcast is not None: self.existing_weather_human.insert('', 'end', values=("☁️  Cloud Cover", f"{float(overcast) * 100:.0f}%" + (f" (transition: {overcast_duration}s)" if overcast_duration else "")))
+                if fog is not None: self.existing_weather_human.insert('', 'end', values=("👁️  Visibility", f"{float(fog) / 1000.0:.1f} km" + (f" (transition: {fog_duration}s)" if fog_duration else "")))
+                if precip is not None:
                     precip_mm = float(precip) * 1000.0
                     duration_text = f" (transition: {precip_duration}s)" if precip_duration else ""
                     self.existing_weather_human.insert('', 'end', values=("🌧️  Precipitation", f"{precip_mm:.1f} mm/h{duration_text}" if precip_mm > 0 else f"None (0.0 mm/h){duration_text}"))
-                if liquid:
+                if liquid is not None:
                     liquid_val = float(liquid)
                     duration_text = f" (transition: {liquid_duration}s)" if liquid_duration else ""
                     self.existing_weather_human.insert('', 'end', values=("🌧️/❄️ Precip. Type", (f"Rain ({liquid_val:.1f})" if liquid_val > 0.5 else f"Snow ({liquid_val:.1f})") + duration_text))
@@ -577,23 +579,11 @@ class MainApplication(tk.Tk):
         self.start_loading("Fetching weather data...")
         
         self.weather_fetch_points = [(lat, lon)]
-        if self.path_dist and self.path_coords_cache and len(self.path_coords_cache) > 2:
+        if self.path_dist and self.path_geometry and len(self.path_geometry) > 2:
             pin_distance_m = self.config.get('pin_distance_km') * 1000
             
             if self.path_dist > pin_distance_m:
-                points = {self.path_coords_cache[0][0]} # Use a set to handle duplicates
-                
-                num_pins = int(self.path_dist // pin_distance_m)
-                for i in range(1, num_pins + 1):
-                    target_dist = i * pin_distance_m
-                    closest_point = min(self.path_coords_cache, key=lambda p: abs(p[1] - target_dist))
-                    points.add(closest_point[0])
-                
-                points.add(self.path_coords_cache[-1][0])
-                
-                # Sort points based on their order in the original path to maintain route progression
-                sorted_points = sorted(list(points), key=lambda p: [c[0] for c in self.path_coords_cache].index(p))
-                self.weather_fetch_points = sorted_points
+                self.weather_fetch_points = self.path_geometry.plan_pins(pin_distance_m)
                 self.log(f"[Info] Long route (>{self.path_dist/1000:.1f}km). Using {len(self.weather_fetch_points)} weather points (~{pin_distance_m/1000}km apart).")
 
         self.raw_forecast_list = self.weather.get_weather_data(self.weather_fetch_points, date_obj)
@@ -692,7 +682,7 @@ class MainApplication(tk.Tk):
              return
 
         route_info = self.current_route_data.get(self.route_listbox.get(route_selections[0]))
-        self.path_coords_cache = None # Clear path cache for scout clicks
+        self.path_coords_cache = None; self.path_geometry = None # Clear path cache for scout clicks
         threading.Thread(target=self.update_activity_info, args=(route_info, coords), daemon=True).start()
 
     def _update_map_with_weather_points(self):
@@ -767,18 +757,20 @@ class MainApplication(tk.Tk):
                 season = self.weather.get_season(date_obj, self.found_coords[0])
                 add_thunder = self.add_thunder_var.get(); add_wind = self.add_wind_var.get(); add_rain = self.add_rain_var.get()
                 transition_secs = self.config.get('weather_transition_secs')
+                duration_hours = self.config.get('generation_hours'); interval_mins = self.config.get('weather_interval_mins')
                 
                 path_coords_for_api = self.path_coords_cache
                 if not path_coords_for_api:
                     path_coords_for_api = [(self.found_coords, 0)] if self.found_coords else []
 
-                weather_events, msg = self.weather.create_weather_events_string(path_coords_for_api, self.path_dist, season, date_obj, start_hour, add_thunder, add_wind, add_rain, self.sound_manager, route_info['path'], transition_secs)
+                weather_events, msg = self.weather.build_weather_events(path_coords_for_api, self.path_dist, season, date_obj, start_hour, add_thunder, add_wind, add_rain, self.sound_manager, route_info['path'], transition_secs, duration_hours, interval_mins)
                 
             if self.shutdown_event.is_set(): return
-            if not weather_events: self.log(f"[ERROR] Weather event string creation failed: {msg}"); self.after(0, self.stop_loading); return
+            if not weather_events: self.log(f"[ERROR] Weather event creation failed: {msg}"); self.after(0, self.stop_loading); return
             self.log(f"[Info] {msg}")
             
-            new_path, save_msg = self.parser.modify_and_save_activity(self.selected_activity_path, weather_events, date_obj, chaotic, season=season)
+            # Live refreshes update an existing file for today in place instead of rebuilding it.
+            new_path, save_msg = self.parser.modify_and_save_activity(self.selected_activity_path, weather_events, date_obj, chaotic, season=season, incremental=not chaotic and not historical)
             
             if new_path:
                 success_message = f"New activity file created:\n\n{Path(new_path).name}"
@@ -854,7 +846,7 @@ class MainApplication(tk.Tk):
 
     def run_global_cleanup(self):
         if not self.config.get('content_paths'): messagebox.showwarning("Warning", "No Content Folders configured in Settings."); return
-        msg = (f"This will scan ALL configured content folders and permanently delete ALL generated files (*.WTHLINK.*.act, WEATHERLINK_*.wav).\n\nThis action cannot be undone. Are you absolutely sure?")
+        msg = (f"This will permanently delete ALL generated files (*.WTHLINK.*.act, WEATHERLINK_*.wav) recorded for ALL configured content folders.\n\nThis action cannot be undone. Are you absolutely sure?")
         if messagebox.askyesno("Confirm GLOBAL Cleanup", msg, icon='warning'):
             self.start_loading("Performing global cleanup...")
             total_acts, total_sounds = 0, 0
@@ -866,6 +858,17 @@ class MainApplication(tk.Tk):
             messagebox.showinfo("Global Cleanup Complete", f"Deleted {total_acts} activity file(s) and {total_sounds} sound file(s) from all content folders.")
             if self.route_listbox.curselection(): self.on_route_select()
 
+    def run_generated_files_verify(self):
+        if not self.config.get('content_paths'): messagebox.showwarning("Warning", "No Content Folders configured in Settings."); return
+        self.start_loading("Scanning content folders for generated files...")
+        total_acts, total_sounds = 0, 0
+        for path in self.config.get('content_paths'):
+            acts, sounds = openrails_parser.OpenRailsParser(path, self.log).verify_generated_files()
+            total_acts += acts; total_sounds += sounds
+        self.stop_loading()
+        messagebox.showinfo("Verification Complete", f"Found {total_acts} activity file(s) and {total_sounds} sound file(s) generated by WeatherLink.")
+        if hasattr(self, '_all_routes_sorted'): self._filter_routes()
+
     def clear_info(self):
         self.generate_live_button.config(state=tk.DISABLED); self.historical_button.config(state=tk.DISABLED); self.found_coords = None; self.selected_activity_path = None; self.historical_selection = None
         self.generate_historical_button.config(state=tk.DISABLED)
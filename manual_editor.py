@@ -4,9 +4,15 @@ from tkinter import ttk, messagebox, simpledialog
 from datetime import datetime
 import random
 import json
-from pathlib import Path
+import hashlib
 import re
 import traceback
+import threading
+import sqlite3
+from weather_events import WeatherChange, ActivitySound
+from sound_scheduler import SoundChannelScheduler
+from event_store import EventStore, ManualEvent
+from preset_store import PresetStore
 
 class PresetManagerWindow(tk.Toplevel):
     def __init__(self, parent):
@@ -40,7 +46,7 @@ class PresetManagerWindow(tk.Toplevel):
 
     def populate_list(self):
         self.listbox.delete(0, tk.END)
-        for preset_name in sorted(self.parent.user_presets.keys()):
+        for preset_name in self.parent.preset_store.names():
             self.listbox.insert(tk.END, preset_name)
 
     def rename_preset(self):
@@ -53,11 +59,14 @@ class PresetManagerWindow(tk.Toplevel):
         new_name = simpledialog.askstring("Rename Preset", f"Enter new name for '{old_name}':", parent=self)
 
         if new_name and new_name != old_name:
-            if new_name in self.parent.user_presets:
+            try: renamed = self.parent.preset_store.rename(old_name, new_name)
+            except KeyError:
+                messagebox.showerror("Preset Not Found", f"The preset '{old_name}' no longer exists.", parent=self)
+                self.populate_list(); self.parent._refresh_preset_menu(); return
+            except sqlite3.Error as e: messagebox.showerror("Error", f"Could not rename preset.\n\n{e}", parent=self); return
+            if not renamed:
                 messagebox.showerror("Name Exists", "A preset with that name already exists.", parent=self)
                 return
-            self.parent.user_presets[new_name] = self.parent.user_presets.pop(old_name)
-            self.parent._save_user_presets()
             self.populate_list()
             self.parent._refresh_preset_menu()
 
@@ -69,12 +78,12 @@ class PresetManagerWindow(tk.Toplevel):
         
         preset_name = self.listbox.get(selection[0])
         if messagebox.askyesno("Confirm Deletion", f"Are you sure you want to delete the preset '{preset_name}'?", parent=self):
-            del self.parent.user_presets[preset_name]
-            self.parent._save_user_presets()
+            self.parent.preset_store.delete(preset_name)
             self.populate_list()
             self.parent._refresh_preset_menu()
 
 class ManualWeatherEditor(tk.Toplevel):
+    TIMELINE_FRAME_MS = 16
     def __init__(self, parent, parser, sound_manager, original_path, player_start_time, initial_season, initial_events=None):
         super().__init__(parent)
 
@@ -86,16 +95,21 @@ class ManualWeatherEditor(tk.Toplevel):
             self.player_start_time = player_start_time
             self.initial_season_val = initial_season
             self.generation_successful = False; self.result_string = None; self.selected_item = None
-            self.user_presets_path = Path("user_presets.json")
             self.drag_data = {"item": None, "x": 0, "y": 0}
+            self._generation_thread = None; self._cancel_generation = threading.Event(); self._close_when_cancelled = False
+            self.events = EventStore() # Source of truth for the sequence; the Treeview and timeline only display it
+            self._timeline_items = {}; self._timeline_redraw_id = None # Event key -> (rectangle, label, last drawn state)
             
             self._define_presets()
-            self._load_user_presets()
+            self.preset_store = PresetStore(log_callback=parent.log)
             self.setup_ui()
+            # Sound discovery may still be running; the category list is filled in once it finishes.
+            self.sound_manager.ready.add_done_callback(lambda _: self._post(self._fill_sound_categories))
             
             if initial_events:
                 for event in initial_events:
-                    self.tree.insert("", "end", values=(int(event['time']), int(event['overcast']), int(event['fog']), event['precip'], event['liquidity'], int(event['transition']), "None"))
+                    self._insert_event(ManualEvent(int(event['time']), int(event['overcast']), int(event['fog']), event['precip'], event['liquidity'], int(event['transition'])))
+                self.draw_timeline()
 
             self.protocol("WM_DELETE_WINDOW", self._cancel)
         except Exception:
@@ -112,28 +126,15 @@ class ManualWeatherEditor(tk.Toplevel):
             "Snow Storm": {"season": 3, "events": [(0, 70, 10000, 1.0, 0.2, 60, "blizzard"), (1800, 100, 2000, 8.0, 0.1, 1800, "blizzard"), (9000, 80, 5000, 2.0, 0.1, 3600, "wind")]}
         }
 
-    def _load_user_presets(self):
-        self.user_presets = {}
-        if self.user_presets_path.exists():
-            try:
-                with open(self.user_presets_path, 'r') as f: self.user_presets = json.load(f)
-            except (json.JSONDecodeError, OSError):
-                self.user_presets = {}
-
-    def _save_user_presets(self):
-        try:
-            with open(self.user_presets_path, 'w') as f: json.dump(self.user_presets, f, indent=4)
-        except OSError:
-            messagebox.showerror("Error", "Could not save user presets.", parent=self)
-            
     def _refresh_preset_menu(self):
         menu = self.preset_menu["menu"]
         menu.delete(0, "end")
         
         all_presets = ["Select a preset..."] + sorted(self.presets.keys())
-        if self.user_presets:
+        user_preset_names = self.preset_store.names()
+        if user_preset_names:
             all_presets.append("--- My Presets ---")
-            all_presets.extend(sorted(self.user_presets.keys()))
+            all_presets.extend(user_preset_names)
 
         self.preset_var.set("Select a preset...")
         for preset_name in all_presets:
@@ -144,8 +145,10 @@ class ManualWeatherEditor(tk.Toplevel):
 
     def setup_ui(self):
         action_button_frame = ttk.Frame(self); action_button_frame.pack(side=tk.BOTTOM, fill=tk.X, padx=10, pady=10)
-        ttk.Button(action_button_frame, text="Generate Manual Activity File", command=self._generate_activity).pack(side=tk.RIGHT, padx=5)
-        ttk.Button(action_button_frame, text="Cancel", command=self._cancel).pack(side=tk.RIGHT)
+        self.generate_button = ttk.Button(action_button_frame, text="Generate Manual Activity File", command=self._generate_activity); self.generate_button.pack(side=tk.RIGHT, padx=5)
+        ttk.Button(action_button_frame, text="Cancel", command=self._cancel_or_stop).pack(side=tk.RIGHT)
+        self.progress_bar = ttk.Progressbar(action_button_frame, mode='determinate', length=160); self.progress_bar.pack(side=tk.LEFT)
+        self.progress_label = ttk.Label(action_button_frame, text=""); self.progress_label.pack(side=tk.LEFT, padx=(10, 0))
 
         main_paned = ttk.PanedWindow(self, orient=tk.VERTICAL); main_paned.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 0))
         top_pane = ttk.Frame(main_paned); main_paned.add(top_pane, weight=3); top_pane.grid_columnconfigure(0, weight=1); top_pane.grid_rowconfigure(0, weight=1)
@@ -155,6 +158,9 @@ class ManualWeatherEditor(tk.Toplevel):
         self.timeline_canvas.bind("<Button-1>", self._on_timeline_press)
         self.timeline_canvas.bind("<B1-Motion>", self._on_timeline_drag)
         self.timeline_canvas.bind("<ButtonRelease-1>", self._on_timeline_release)
+        self.timeline_canvas.bind("<Configure>", lambda e: self.draw_timeline())
+        self.timeline_canvas.tag_bind("event", "<Enter>", lambda e: self.timeline_canvas.itemconfig("current", width=2))
+        self.timeline_canvas.tag_bind("event", "<Leave>", lambda e: self.timeline_canvas.itemconfig("current", width=1))
 
         tree_frame = ttk.Frame(top_pane); tree_frame.grid(row=1, column=0, sticky="nsew", padx=(0, 5)); tree_frame.grid_rowconfigure(0, weight=1); tree_frame.grid_columnconfigure(0, weight=1)
         top_pane.grid_rowconfigure(1, weight=1)
@@ -188,34 +194,48 @@ class ManualWeatherEditor(tk.Toplevel):
         self.event_vars = { "time": tk.StringVar(), "overcast": tk.StringVar(), "fog": tk.StringVar(), "precip": tk.StringVar(), "liquidity": tk.StringVar(), "transition": tk.StringVar(), "sound": tk.StringVar() }
         labels = ["Time (seconds)", "Overcast (0-100)", "Fog Distance (meters)", "Precipitation (mm/h)", "Liquidity (0.0 for Snow, 1.0 for Rain)", "Transition Time (seconds)", "Sound Category"]
         keys = ["time", "overcast", "fog", "precip", "liquidity", "transition", "sound"]
-        sound_categories = ["None"] + sorted(self.sound_manager.sounds.keys())
 
         for i, (label_text, key) in enumerate(zip(labels, keys)):
             ttk.Label(details_frame, text=f"{label_text}:").grid(row=i + 2, column=0, sticky="w", padx=5, pady=5)
-            widget = ttk.Combobox(details_frame, textvariable=self.event_vars[key], values=sound_categories, state="readonly") if key == "sound" else ttk.Entry(details_frame, textvariable=self.event_vars[key])
+            widget = ttk.Combobox(details_frame, textvariable=self.event_vars[key], values=["None"], state="readonly") if key == "sound" else ttk.Entry(details_frame, textvariable=self.event_vars[key])
             widget.grid(row=i + 2, column=1, sticky="ew", padx=5, pady=5)
+            if key == "sound": self.sound_menu = widget
         details_frame.grid_columnconfigure(1, weight=1)
         ttk.Button(details_frame, text="Add/Update Event in List", command=self._add_or_update_event).grid(row=len(labels) + 2, column=0, columnspan=2, pady=10)
         
         self.draw_timeline()
 
+    def _fill_sound_categories(self):
+        if self.winfo_exists(): self.sound_menu.config(values=["None"] + sorted(self.sound_manager.sounds.keys()))
+
     def _on_preset_selected(self, preset_name):
         self.preset_var.set(preset_name)
         if preset_name == "Select a preset..." or "---" in preset_name: return
-        if self.tree.get_children() and not messagebox.askyesno("Confirm Overwrite", "Loading a preset will overwrite all current events. Continue?", parent=self):
+        if self.events and not messagebox.askyesno("Confirm Overwrite", "Loading a preset will overwrite all current events. Continue?", parent=self):
             self.preset_var.set("Select a preset..."); return
         
-        self.tree.delete(*self.tree.get_children())
-        preset_data = self.presets.get(preset_name) or self.user_presets.get(preset_name)
+        self.events.clear(); self.tree.delete(*self.tree.get_children()); self.selected_item = None
+        preset_data = self.presets.get(preset_name) or self.preset_store.get(preset_name)
         
         season_val = preset_data.get("season", self.initial_season_val)
         self.season_var.set(self.season_menu['values'][season_val])
 
         for event_data in preset_data["events"]:
-            adjusted_data = (event_data[0] + self.player_start_time,) + event_data[1:]
-            self.tree.insert("", "end", values=adjusted_data)
+            event = ManualEvent.from_values(event_data)
+            self._insert_event(event.replace(time=event.time + self.player_start_time))
         self.preset_var.set("Select a preset..."); self.draw_timeline()
 
+    def _insert_event(self, event):
+        key, index = self.events.add(event)
+        self.tree.insert("", index, iid=key, values=event.as_tuple())
+        return key
+
+    def _update_event(self, key, event):
+        # Rows are only re-positioned when the event's time moved it past a neighbour.
+        index = self.events.replace(key, event)
+        self.tree.item(key, values=event.as_tuple())
+        if self.tree.index(key) != index: self.tree.move(key, "", index)
+
     def _on_tree_select(self, event):
         selected_items = self.tree.selection()
         if selected_items: self.selected_item = selected_items[0]; self._edit_selected_event()
@@ -228,18 +248,18 @@ class ManualWeatherEditor(tk.Toplevel):
 
     def _add_new_event(self):
         self._clear_fields()
-        if not self.tree.get_children(): self.event_vars["time"].set(str(self.player_start_time))
+        if not self.events: self.event_vars["time"].set(str(self.player_start_time))
         # self.winfo_children()[1].winfo_children()[1].winfo_children()[0].winfo_children()[5].focus_set() # This is too fragile
 
     def _edit_selected_event(self):
         if not self.selected_item: return
-        values = self.tree.item(self.selected_item, "values"); keys = ["time", "overcast", "fog", "precip", "liquidity", "transition", "sound"]
-        for key, value in zip(keys, values): self.event_vars[key].set(value)
+        if self.selected_item not in self.events: return
+        for key, value in zip(ManualEvent.FIELDS, self.events.get(self.selected_item).as_tuple()): self.event_vars[key].set(value)
 
     def _delete_selected_event(self):
         if not self.selected_item: messagebox.showwarning("No Selection", "Please select an event to delete.", parent=self); return
         if messagebox.askyesno("Confirm Deletion", "Are you sure you want to delete the selected event?", parent=self):
-            self.tree.delete(self.selected_item); self._clear_fields(); self.draw_timeline()
+            self.events.remove(self.selected_item); self.tree.delete(self.selected_item); self.selected_item = None; self._clear_fields(); self.draw_timeline()
 
     def _add_or_update_event(self):
         try:
@@ -247,34 +267,30 @@ class ManualWeatherEditor(tk.Toplevel):
             if not (0 <= values["overcast"] <= 100): raise ValueError("Overcast must be between 0 and 100.")
             if not (0.0 <= values["liquidity"] <= 1.0): raise ValueError("Liquidity must be between 0.0 and 1.0.")
         except ValueError as e: messagebox.showerror("Invalid Input", f"Please enter valid numbers.\n\n{e}", parent=self); return
-        formatted_values = (values["time"], values["overcast"], values["fog"], values["precip"], values["liquidity"], values["transition"], values["sound"])
-        if self.selected_item: self.tree.item(self.selected_item, values=formatted_values)
-        else: self.tree.insert("", "end", values=formatted_values)
+        event = ManualEvent(**values)
+        if self.selected_item in self.events: self._update_event(self.selected_item, event)
+        else: self._insert_event(event)
         self._clear_fields(); self.draw_timeline()
 
     def _save_preset(self):
-        if not self.tree.get_children(): messagebox.showwarning("No Events", "There is no weather sequence to save.", parent=self); return
+        if not self.events: messagebox.showwarning("No Events", "There is no weather sequence to save.", parent=self); return
         
         name = simpledialog.askstring("Save Preset", "Enter a name for this preset:", parent=self)
         if not name: return
-        if name in self.presets or name in self.user_presets:
+        if name in self.presets or name in self.preset_store:
             if not messagebox.askyesno("Confirm Overwrite", "A preset with this name already exists. Overwrite it?", parent=self): return
         
-        event_data = []
-        for item_id in self.tree.get_children():
-            values = self.tree.item(item_id, 'values')
-            time_val = int(values[0])
-            relative_time = time_val - self.player_start_time
-            if relative_time < 0:
-                messagebox.showerror("Invalid Time", f"Event at {time_val}s occurs before the player start time of {self.player_start_time}s and cannot be saved in a preset.", parent=self)
-                return
-            event_data.append((relative_time,) + tuple(values[1:]))
+        first = self.events.first()
+        if first.time < self.player_start_time:
+            messagebox.showerror("Invalid Time", f"Event at {first.time}s occurs before the player start time of {self.player_start_time}s and cannot be saved in a preset.", parent=self)
+            return
+        event_data = [(event.time - self.player_start_time,) + event.as_tuple()[1:] for event in self.events]
         
         season_str = self.season_var.get()
         season_val = int(re.search(r'\((\d)\)', season_str).group(1))
 
-        self.user_presets[name] = {"season": season_val, "events": event_data}
-        self._save_user_presets()
+        try: self.preset_store.upsert(name, season_val, event_data)
+        except sqlite3.Error as e: messagebox.showerror("Error", f"Could not save user preset.\n\n{e}", parent=self); return
         self._refresh_preset_menu()
         messagebox.showinfo("Success", f"Preset '{name}' saved successfully.", parent=self)
 
@@ -282,44 +298,63 @@ class ManualWeatherEditor(tk.Toplevel):
         PresetManagerWindow(self)
 
     def draw_timeline(self):
-        self.timeline_canvas.delete("all")
-        width = self.timeline_canvas.winfo_width()
-        height = self.timeline_canvas.winfo_height()
-        
-        items = sorted([(int(self.tree.item(i, 'values')[0]), i) for i in self.tree.get_children()])
+        # Coalesces redraw requests (one per edit, or per mouse-motion event while dragging) into at most one per frame.
+        if self._timeline_redraw_id is None: self._timeline_redraw_id = self.after(self.TIMELINE_FRAME_MS, self._redraw_timeline)
+
+    def _redraw_timeline(self):
+        # Canvas items persist per event; only those whose position, colour or label changed are touched.
+        self._timeline_redraw_id = None
+        if not self.winfo_exists(): return
+        canvas = self.timeline_canvas
+        width = canvas.winfo_width()
+        height = canvas.winfo_height()
+
+        items = self.events.items()
+        for item_id in [k for k in self._timeline_items if k not in self.events]:
+            rect_id, text_id, _ = self._timeline_items.pop(item_id); canvas.delete(rect_id, text_id)
         if not items: return
-        
-        min_time = items[0][0]
-        max_time = items[-1][0] + 3600 # Add an hour for the last event's duration
-        self.timeline_min_time = min_time
-        self.timeline_max_time = max_time
-        total_duration = max_time - min_time
-        if total_duration <= 0: total_duration = 1
-        self.timeline_total_duration = total_duration
-
-        for i, (time_val, item_id) in enumerate(items):
-            values = self.tree.item(item_id, 'values')
-            precip = float(values[3])
-            liquidity = float(values[4])
-            
-            start_x = (time_val - min_time) / total_duration * width
+
+        if not self.drag_data["item"]: # The scale stays fixed while dragging, so only the moved event and its neighbours change
+            min_time = items[0][1].time
+            max_time = items[-1][1].time + 3600 # Add an hour for the last event's duration
+            self.timeline_min_time = min_time
+            self.timeline_max_time = max_time
+            total_duration = max_time - min_time
+            if total_duration <= 0: total_duration = 1
+            self.timeline_total_duration = total_duration
+        min_time, total_duration = self.timeline_min_time, self.timeline_total_duration
+
+        created = False
+        for i, (item_id, event) in enumerate(items):
+            start_x = (event.time - min_time) / total_duration * width
             end_x = width
             if i + 1 < len(items):
-                end_x = (items[i+1][0] - min_time) / total_duration * width
+                end_x = (items[i+1][1].time - min_time) / total_duration * width
             
             color = "#C0C0C0" # Default grey
-            if precip > 0:
-                color = "#4682B4" if liquidity > 0.5 else "#FFFFFF" # Blue for rain, white for snow
-            
-            rect_id = self.timeline_canvas.create_rectangle(start_x, 0, end_x, height, fill=color, outline="black", tags=("event", item_id))
-            text_id = self.timeline_canvas.create_text(start_x + 5, height/2, text=f"{time_val}s", anchor="w", tags=("event_text", item_id))
-            self.timeline_canvas.tag_bind(rect_id, "<Enter>", lambda e, r=rect_id: self.timeline_canvas.itemconfig(r, width=2))
-            self.timeline_canvas.tag_bind(rect_id, "<Leave>", lambda e, r=rect_id: self.timeline_canvas.itemconfig(r, width=1))
+            if event.precip > 0:
+                color = "#4682B4" if event.liquidity > 0.5 else "#FFFFFF" # Blue for rain, white for snow
+            state = (start_x, end_x, height, color, event.time)
+
+            drawn = self._timeline_items.get(item_id)
+            if drawn is None:
+                rect_id = canvas.create_rectangle(start_x, 0, end_x, height, fill=color, outline="black", tags=("event", item_id))
+                text_id = canvas.create_text(start_x + 5, height/2, text=f"{event.time}s", anchor="w", tags=("event_text", item_id))
+                self._timeline_items[item_id] = (rect_id, text_id, state); created = True
+                continue
+            rect_id, text_id, last_state = drawn
+            if state == last_state: continue
+            if state[:3] != last_state[:3]: canvas.coords(rect_id, start_x, 0, end_x, height); canvas.coords(text_id, start_x + 5, height/2)
+            if color != last_state[3]: canvas.itemconfig(rect_id, fill=color)
+            if event.time != last_state[4]: canvas.itemconfig(text_id, text=f"{event.time}s")
+            self._timeline_items[item_id] = (rect_id, text_id, state)
+        if created: canvas.tag_raise("event_text")
 
     def _on_timeline_press(self, event):
-        canvas_item = self.timeline_canvas.find_closest(event.x, event.y)[0]
-        tags = self.timeline_canvas.gettags(canvas_item)
-        if "event" in tags:
+        closest = self.timeline_canvas.find_closest(event.x, event.y)
+        if not closest: return
+        tags = self.timeline_canvas.gettags(closest[0])
+        if "event" in tags or "event_text" in tags:
             tree_item_id = tags[1]
             self.drag_data["item"] = tree_item_id
             self.drag_data["x"] = event.x
@@ -332,78 +367,100 @@ class ManualWeatherEditor(tk.Toplevel):
         width = self.timeline_canvas.winfo_width()
         new_time = self.timeline_min_time + (event.x / width) * self.timeline_total_duration
         new_time = max(self.player_start_time, int(new_time)) # Prevent dragging before player start
+        if new_time == self.events.get(self.drag_data["item"]).time: return
         
-        current_values = list(self.tree.item(self.drag_data["item"], "values"))
-        current_values[0] = str(new_time)
-        self.tree.item(self.drag_data["item"], values=tuple(current_values))
+        self._update_event(self.drag_data["item"], self.events.get(self.drag_data["item"]).replace(time=new_time))
         self.event_vars["time"].set(str(new_time))
         self.draw_timeline()
 
     def _on_timeline_release(self, event):
         self.drag_data["item"] = None
-        self.draw_timeline()
+        self.draw_timeline() # Rescales to the new first and last events
 
     def _generate_activity(self):
+        if self._generation_thread and self._generation_thread.is_alive(): return
         # --- Pre-generation validation ---
-        for item_id in self.tree.get_children():
-            values = self.tree.item(item_id, 'values')
-            time_val = int(values[0])
-            if time_val < self.player_start_time:
-                messagebox.showerror("Invalid Event Time", f"An event is scheduled for {time_val}s, which is before the activity start time of {self.player_start_time}s.\nPlease correct the time before generating.", parent=self)
-                return
+        first = self.events.first() # Events are sorted, so only the earliest can start too soon
+        if first is not None and first.time < self.player_start_time:
+            messagebox.showerror("Invalid Event Time", f"An event is scheduled for {first.time}s, which is before the activity start time of {self.player_start_time}s.\nPlease correct the time before generating.", parent=self)
+            return
+        if not self.events: messagebox.showwarning("No Events", "There are no weather events to generate.", parent=self); return
+
+        # The worker only ever sees this immutable, typed copy of the sequence, never the widgets.
+        events = self.events.snapshot()
+        season_str = self.season_var.get()
+        season_val = int(re.search(r'\((\d)\)', season_str).group(1))
+
+        self._cancel_generation = threading.Event()
+        self.generate_button.config(state=tk.DISABLED); self.progress_bar.config(maximum=len(events), value=0)
+        self.progress_label.config(text="Preparing sounds...")
+        self._generation_thread = threading.Thread(target=self._generation_worker, args=(events, season_val, self._cancel_generation), daemon=True)
+        self._generation_thread.start()
+
+    def _post(self, callback, *args):
+        # Hands a result from the worker back to the Tk thread; the editor may have been closed meanwhile.
+        try: self.after(0, callback, *args)
+        except (tk.TclError, RuntimeError): pass
 
-        weather_event_blocks, sound_event_blocks = [], []
-        sound_channels, sound_playlists = {}, {}
-        global_sound_counter = 0
-
-        items_with_time = [(int(self.tree.item(item, 'values')[0]), item) for item in self.tree.get_children()]
-        if not items_with_time: messagebox.showwarning("No Events", "There are no weather events to generate.", parent=self); return
-        sorted_items = sorted(items_with_time, key=lambda x: x[0])
-
-        for i, (time_val, item_id) in enumerate(sorted_items):
-            values = self.tree.item(item_id, 'values')
-            time_s, overcast_val, fog_m, precip_mmh, liquidity_val, transition_s, sound_category = values
-            time_s, overcast_val, fog_m, precip_mmh, liquidity_val, transition_s = map(float, (time_s, overcast_val, fog_m, precip_mmh, liquidity_val, transition_s))
-            weather_event_blocks.append(f"""        EventCategoryTime ( ID ( {1000 + i} ) Name ( WTHLINK_Manual_{i} ) Time ( {int(time_s)} ) Outcomes ( ORTSWeatherChange ( ORTSOvercast ( {overcast_val / 100.0:.2f} {int(transition_s)} ) ORTSFog ( {int(fog_m)} {int(transition_s)} ) ORTSPrecipitationIntensity ( {precip_mmh / 1000.0:.5f} {int(transition_s)} ) ORTSPrecipitationLiquidity ( {liquidity_val:.1f} {int(transition_s)} ) ) ) )""")
-
-            if sound_category and sound_category != "None":
-                sound_def = next((s for s in self.sound_manager.sound_definitions if s['category'] == sound_category), None)
-                if not sound_def: continue
-                start_time, end_time = int(time_s), sorted_items[i+1][0] if i + 1 < len(sorted_items) else int(time_s) + 7200
-                if sound_def['condition'] == 'thunderstorm':
-                    if self.sound_manager.sounds.get(sound_category):
-                        sound_info = random.choice(self.sound_manager.sounds[sound_category])
-                        if end_time > start_time + sound_info['duration']:
-                            schedule_time = random.randint(start_time, int(end_time - sound_info['duration']))
-                            sound_filename = self.sound_manager.copy_sound_to_route(sound_info['path'], self.parser.content_path)
-                            if sound_filename:
-                                sound_event_blocks.append(f"""        EventCategoryTime ( ID ( 9{global_sound_counter} ) Name ( WTHLINK_ManualSound_{global_sound_counter} ) Time ( {schedule_time} ) Outcomes ( ORTSActivitySound ( ORTSActSoundFile ( \"{sound_filename}\" {sound_info['sound_type']} ) ) ) )""")
-                                global_sound_counter += 1
-                else:
-                    sound_channels.setdefault(sound_category, start_time)
-                    current_time = max(start_time, sound_channels[sound_category])
-                    while current_time < end_time:
-                        if not sound_playlists.get(sound_category) or not sound_playlists[sound_category]:
-                            all_sounds = self.sound_manager.sounds.get(sound_category, [])
-                            if not all_sounds: break
-                            sound_playlists[sound_category] = random.sample(all_sounds, len(all_sounds))
-                        sound_info = sound_playlists[sound_category].pop()
+    def _generation_worker(self, events, season_val, cancelled):
+        try:
+            weather_event_blocks, sound_event_blocks = [], []
+            global_sound_counter = 0
+            # Seeded from the sequence and sound library, so regenerating an unchanged sequence produces an identical file.
+            seed_source = json.dumps([events, season_val, self.sound_manager.library_signature()])
+            rng = random.Random(hashlib.sha256(seed_source.encode('utf-8')).hexdigest())
+            def playlist_for(category):
+                return self.sound_manager.sounds.get(category, []) if scheduler.is_sporadic(category) else self.sound_manager.ambient_playlist(category)
+            scheduler = SoundChannelScheduler(self.sound_manager.sound_definitions, playlist_for, rng)
+
+            with self.sound_manager.generated.batch(): # One manifest write for all the sounds deployed here
+                for i, (time_s, overcast_val, fog_m, precip_mmh, liquidity_val, transition_s, sound_category) in enumerate(events):
+                    if cancelled.is_set(): self._post(self._on_generation_finished, None, None, True); return
+                    self._post(self._update_progress, i, f"Scheduling event {i + 1} of {len(events)}...")
+                    weather_event_blocks.append(WeatherChange(time_s, f"WTHLINK_Manual_{i}", 1000 + i, overcast_val / 100.0, fog_m, precip_mmh / 1000.0, liquidity_val, transition_s))
+
+                    start_time, end_time = time_s, events[i+1][0] if i + 1 < len(events) else time_s + 7200
+                    categories = [sound_category] if sound_category and sound_category != "None" else []
+                    for schedule_time, category, sound_info in scheduler.feed(start_time, end_time, categories):
                         sound_filename = self.sound_manager.copy_sound_to_route(sound_info['path'], self.parser.content_path)
                         if sound_filename:
-                            sound_event_blocks.append(f"""        EventCategoryTime ( ID ( 9{global_sound_counter} ) Name ( WTHLINK_ManualSound_{global_sound_counter} ) Time ( {current_time} ) Outcomes ( ORTSActivitySound ( ORTSActSoundFile ( \"{sound_filename}\" {sound_info['sound_type']} ) ) ) )""")
+                            sound_event_blocks.append(ActivitySound(schedule_time, sound_filename, sound_info['sound_type'], f"WTHLINK_ManualSound_{global_sound_counter}", int(f"9{global_sound_counter}")))
                             global_sound_counter += 1
-                            current_time += sound_info['duration']
-                    sound_channels[sound_category] = current_time
-        
-        season_str = self.season_var.get()
-        season_val = int(re.search(r'\((\d)\)', season_str).group(1))
 
-        event_string = "\n".join(weather_event_blocks + sound_event_blocks)
-        new_path, msg = self.parser.modify_and_save_activity(self.original_path, event_string, manual_suffix="MANUAL", season=season_val)
+            if cancelled.is_set(): self._post(self._on_generation_finished, None, None, True); return
+            self._post(self._update_progress, len(events), "Writing activity file...")
+            new_path, msg = self.parser.modify_and_save_activity(self.original_path, weather_event_blocks + sound_event_blocks, manual_suffix="MANUAL", season=season_val)
+            self._post(self._on_generation_finished, new_path, msg, False)
+        except Exception as e:
+            self._post(self._on_generation_finished, None, f"{e}\n\n{traceback.format_exc()}", False)
+
+    def _update_progress(self, value, message):
+        if not self.winfo_exists(): return
+        self.progress_bar.config(value=value); self.progress_label.config(text=message)
+
+    def _on_generation_finished(self, new_path, msg, was_cancelled):
+        if not self.winfo_exists(): return
+        self._generation_thread = None
+        self.generate_button.config(state=tk.NORMAL); self.progress_bar.config(value=0)
+        if was_cancelled:
+            self.progress_label.config(text="Generation cancelled.")
+            if self._close_when_cancelled: self.destroy()
+            return
+        self.progress_label.config(text="")
         if new_path:
             messagebox.showinfo("Success", f"New manual activity file created:\n\n{new_path.name}", parent=self); self.generation_successful = True; self.destroy()
         else:
             messagebox.showerror("Error", f"Failed to create activity file:\n\n{msg}", parent=self)
 
+    def _cancel_or_stop(self):
+        # While generating, the Cancel button stops the worker and keeps the editor open.
+        if self._generation_thread and self._generation_thread.is_alive():
+            self._cancel_generation.set(); self.progress_label.config(text="Cancelling...")
+        else: self._cancel()
+
     def _cancel(self):
+        # Closing mid-generation waits for the worker to notice the cancellation before the window goes away.
+        if self._generation_thread and self._generation_thread.is_alive():
+            self._cancel_generation.set(); self._close_when_cancelled = True; self.progress_label.config(text="Cancelling...")
+            return
         self.destroy()
\ No newline at end of file
@@ -1,13 +1,90 @@
 # openrails_parser.py
 import re
 import math
+import heapq
+import bisect
 import random
 from pathlib import Path
 from datetime import datetime
 import shutil
+import codecs
+import contextlib
+import os
+import tempfile
+import mmap
+import hashlib
+from array import array
+
+from generated_manifest import GeneratedFilesManifest
+from activity_index import ActivityIndex
+from weather_events import parse_weather_event, iter_event_lines
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
 
 APP_SUFFIX = "WTHLINK"
 
+_BLOCK_TOKEN_PATTERN = re.compile(r'"[^"]*"|([A-Za-z_]\w*)?\s*\(|\)')
+_ACTIVITY_NAME_PATTERN = re.compile(r'(\bName\s*\(\s*(?:"([^"]+)"|([^\s\)]+))\s*\))', re.IGNORECASE)
+_ACTIVITY_LIST_NAME_PATTERN = re.compile(r'\bName\s*\(\s*(?:"([^"]+)"|([^\s\)]+))\s*\)', re.IGNORECASE | re.DOTALL)
+_PATH_ID_PATTERN = re.compile(r'PathID\s*\(\s*(?:"([^"]*)"|(\S+))\s*(?:\s+[0-9]+)?\s*\)', re.IGNORECASE)
+_START_TIME_PATTERN = re.compile(r'Player_Traffic_Definition\s*\(\s*(\d+)', re.IGNORECASE | re.DOTALL)
+_SEASON_PATTERN = re.compile(r'(\bSeason\s*\(\s*)(\d)(\s*\))', re.IGNORECASE)
+_TDB_VECTOR_NODE_PATTERN = re.compile(r'TrackNode\s*\(\s*(\d+)\s+TrVectorNode\s*\(\s*TrVectorSections\s*\(\s*(\d+)([^()]*)\)', re.IGNORECASE)
+_WTHLINK_EVENT_NAME_PATTERN = re.compile(fr'\bName\s*\(\s*"?({APP_SUFFIX}_[^\s()"]*)', re.IGNORECASE)
+
+class RouteFileScanner:
+    # Searches a route file's raw bytes through mmap and decodes only the spans around matched tokens, so memory use
+    # stays flat however large the file is. Handles the UTF-16-LE files MSTS tools write as well as UTF-8.
+    def __init__(self, path):
+        self.path = path; self._file = None; self.mm = b""; self._patterns = {}
+
+    def __enter__(self):
+        self._file = open(self.path, 'rb')
+        try: self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: self.mm = b"" # Empty file
+        head = self.mm[:3]
+        if head[:2] == b'\xff\xfe': self.encoding, self.start, self.width = 'utf-16-le', 2, 2
+        elif head == b'\xef\xbb\xbf': self.encoding, self.start, self.width = 'utf-8', 3, 1
+        elif head[1:2] == b'\x00': self.encoding, self.start, self.width = 'utf-16-le', 0, 2
+        else: self.encoding, self.start, self.width = 'utf-8', 0, 1
+        return self
+
+    def __exit__(self, *exc):
+        if isinstance(self.mm, mmap.mmap): self.mm.close()
+        self._file.close()
+
+    def _aligned(self, pos): return (pos - self.start) % self.width == 0
+
+    def iter_spans(self, token, terminator=')', window=None, lookbehind=0):
+        # Yields the decoded text from each whole-word occurrence of token up to the next terminator (inclusive),
+        # or up to window characters when no terminator is given, plus lookbehind characters before it.
+        pattern = self._patterns.get(token)
+        if pattern is None: pattern = self._patterns[token] = re.compile(re.escape(token.encode(self.encoding)), re.IGNORECASE)
+        term = terminator.encode(self.encoding) if terminator else None
+        for m in pattern.finditer(self.mm, self.start):
+            begin = m.start()
+            if not self._aligned(begin): continue
+            if begin > self.start:
+                prev = self.mm[begin - self.width:begin].decode(self.encoding, errors='replace')
+                if prev.isalnum() or prev == '_': continue
+            if term is None: end = min(len(self.mm), begin + window * self.width)
+            else:
+                end = self.mm.find(term, m.end())
+                while end != -1 and not self._aligned(end): end = self.mm.find(term, end + 1)
+                if end == -1: return
+                end += len(term)
+            yield self.mm[max(self.start, begin - lookbehind * self.width):end].decode(self.encoding, errors='replace')
+
+    def first_match(self, token, regex, window=512):
+        for span in self.iter_spans(token, terminator=None, window=window):
+            m = regex.match(span)
+            if m: return m
+        return None
+
 class GoodeProjection:
     def __init__(self):
         self.earthRadius = 6370997; self.tileSize = 2048; self.ul_x = -20013965; self.ul_y = 8674008
@@ -51,23 +128,233 @@ class GoodeProjection:
     
     def Adjust_Lon(self, val): return val - ((1 if val >= 0 else -1) * 2 * math.pi) if abs(val) > math.pi else val
 
+    def ConvertWTC_Batch(self, tile_x, tile_z, loc_x, loc_z):
+        # Whole-path version of ConvertWTC. Returns (lats, lons) in degrees; points outside the projection are NaN.
+        if not NUMPY_AVAILABLE:
+            lats, lons = [], []
+            for tx, tz, lx, lz in zip(tile_x, tile_z, loc_x, loc_z):
+                lat, lon = self.ConvertWTC(tx, tz, lx, lz)
+                lats.append(math.nan if lat is None else lat); lons.append(math.nan if lon is None else lon)
+            return lats, lons
+        tile_x = np.asarray(tile_x, dtype=np.float64); tile_z = np.asarray(tile_z, dtype=np.float64)
+        Y = self.ul_y - ((self.wt_ns_offset - tile_z - 1) * self.tileSize) + np.asarray(loc_z, dtype=np.float64)
+        X = self.ul_x + ((tile_x - self.wt_ew_offset - 1) * self.tileSize) + np.asarray(loc_x, dtype=np.float64)
+        return self.Goode_Inverse_Batch(X, Y)
+
+    def Goode_Inverse_Batch(self, GX, GY):
+        earthR = self.earthRadius; GX = np.asarray(GX, dtype=np.float64); GY = np.asarray(GY, dtype=np.float64)
+        west = GX <= earthR * -0.698131700798
+        south_col = np.where(GX <= earthR * -1.74532925199, 0, np.where(GX <= earthR * -0.349065850399, 1, np.where(GX <= earthR * 1.3962634016, 2, 3)))
+        region = np.where(GY >= earthR * 0.710987989993, np.where(west, 0, 2),
+                 np.where(GY >= 0, np.where(west, 1, 3),
+                 np.where(GY >= earthR * -0.710987989993, np.array([4, 5, 8, 9])[south_col], np.array([6, 7, 10, 11])[south_col])))
+        lon_center = np.array(self.Lon_Center)[region]; GX = GX - np.array(self.F_East)[region]
+        sinusoidal = np.isin(region, [1, 3, 4, 5, 8, 9])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Sinusoidal zones
+            s_lat = GY / earthR
+            s_lon = lon_center + GX / (earthR * np.cos(s_lat))
+            s_lon = np.where(np.abs(s_lon) > math.pi, s_lon - np.where(s_lon >= 0, 1, -1) * 2 * math.pi, s_lon)
+            s_lon = np.where(np.abs(np.abs(s_lat) - math.pi / 2) > 1e-10, s_lon, lon_center)
+            # Mollweide zones
+            arg = (GY + 0.0528035274542 * earthR * np.where(GY >= 0, 1, -1)) / (1.4142135623731 * earthR)
+            valid = np.abs(arg) <= 1
+            theta = np.arcsin(np.clip(arg, -1, 1))
+            m_lon = lon_center + (GX / (0.900316316158 * earthR * np.cos(theta)))
+            arg = (2 * theta + np.sin(2 * theta)) / math.pi
+            valid &= np.abs(arg) <= 1
+            m_lat = np.arcsin(np.clip(arg, -1, 1))
+        lat = np.where(sinusoidal, s_lat, np.where(valid, m_lat, np.nan))
+        lon = np.where(sinusoidal, s_lon, np.where(valid, m_lon, np.nan))
+        return np.degrees(lat), np.degrees(lon)
+
+class PathGeometry:
+    # Full-resolution path nodes plus the cumulative along-track distance to each one, so the map and the
+    # weather pins can each choose their own level of detail.
+    EARTH_RADIUS = 6371000
+
+    def __init__(self, lats, lons, cum_dist):
+        self.lats = lats; self.lons = lons; self.cum_dist = cum_dist; self._pin_cache = {}
+        self.total_dist = float(cum_dist[-1]) if len(cum_dist) else 0.0
+
+    @classmethod
+    def from_coords(cls, lats, lons):
+        if NUMPY_AVAILABLE:
+            lats = np.asarray(lats, dtype=np.float64); lons = np.asarray(lons, dtype=np.float64)
+            phi = np.radians(lats); lam = np.radians(lons)
+            a = np.sin(np.diff(phi) / 2) ** 2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2
+            segments = 2 * cls.EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+            return cls(lats, lons, np.concatenate(([0.0], np.cumsum(segments))))
+        lats = [float(v) for v in lats]; lons = [float(v) for v in lons]; cum_dist = [0.0]
+        for i in range(1, len(lats)):
+            phi1, phi2 = math.radians(lats[i - 1]), math.radians(lats[i])
+            a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lons[i] - lons[i - 1]) / 2) ** 2
+            cum_dist.append(cum_dist[-1] + 2 * cls.EARTH_RADIUS * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
+        return cls(lats, lons, cum_dist)
+
+    def __len__(self): return len(self.cum_dist)
+
+    def point(self, i): return (float(self.lats[i]), float(self.lons[i]))
+
+    def simplify(self, tolerance_m=25.0, max_points=None):
+        # Douglas-Peucker on a local equirectangular projection. The segment with the largest deviation is split
+        # first, so stopping at the point budget still keeps the most significant curves and junctions.
+        n = len(self)
+        if n <= 2: return list(range(n))
+        lat0 = math.radians(float(np.mean(self.lats)) if NUMPY_AVAILABLE else sum(self.lats) / n); k_x = self.EARTH_RADIUS * math.cos(lat0) * math.pi / 180; k_y = self.EARTH_RADIUS * math.pi / 180
+        if NUMPY_AVAILABLE:
+            xs = np.asarray(self.lons) * k_x; ys = np.asarray(self.lats) * k_y
+        else:
+            xs = [v * k_x for v in self.lons]; ys = [v * k_y for v in self.lats]
+
+        def farthest(i, j):
+            dx, dy = xs[j] - xs[i], ys[j] - ys[i]; seg_len = math.hypot(dx, dy)
+            if NUMPY_AVAILABLE:
+                px = xs[i + 1:j] - xs[i]; py = ys[i + 1:j] - ys[i]
+                dists = np.abs(dx * py - dy * px) / seg_len if seg_len else np.hypot(px, py)
+                k = int(np.argmax(dists)); return i + 1 + k, float(dists[k])
+            best_k, best_d = i + 1, -1.0
+            for k in range(i + 1, j):
+                px, py = xs[k] - xs[i], ys[k] - ys[i]
+                d = abs(dx * py - dy * px) / seg_len if seg_len else math.hypot(px, py)
+                if d > best_d: best_k, best_d = k, d
+            return best_k, best_d
+
+        keep = {0, n - 1}; heap = []; budget = max(2, max_points or n)
+        def push(i, j):
+            if j - i >= 2:
+                k, d = farthest(i, j); heapq.heappush(heap, (-d, i, j, k))
+        push(0, n - 1)
+        while heap and len(keep) < budget:
+            neg_d, i, j, k = heapq.heappop(heap)
+            if -neg_d <= tolerance_m: break
+            keep.add(k); push(i, k); push(k, j)
+        return sorted(keep)
+
+    def simplified_coords(self, tolerance_m=25.0, max_points=None):
+        return [(self.point(i), float(self.cum_dist[i])) for i in self.simplify(tolerance_m, max_points)]
+
+    def interpolate(self, distances):
+        # Exact positions at the given along-track distances, interpolated between the surrounding nodes.
+        if NUMPY_AVAILABLE:
+            targets = np.clip(np.asarray(distances, dtype=np.float64), 0.0, self.total_dist)
+            return list(zip(np.interp(targets, self.cum_dist, self.lats).tolist(), np.interp(targets, self.cum_dist, self.lons).tolist()))
+        points = []
+        for target in distances:
+            target = min(max(target, 0.0), self.total_dist)
+            i = min(max(bisect.bisect_right(self.cum_dist, target), 1), len(self) - 1)
+            span = self.cum_dist[i] - self.cum_dist[i - 1]; t = (target - self.cum_dist[i - 1]) / span if span else 0.0
+            points.append((self.lats[i - 1] + (self.lats[i] - self.lats[i - 1]) * t, self.lons[i - 1] + (self.lons[i] - self.lons[i - 1]) * t))
+        return points
+
+    def plan_pins(self, pin_distance_m):
+        # Start, one pin every pin_distance_m along the track, and the end, in route order. Cached per spacing.
+        pins = self._pin_cache.get(pin_distance_m)
+        if pins is None:
+            num_pins = int(self.total_dist // pin_distance_m) if pin_distance_m > 0 else 0
+            pins = []
+            for point in [self.point(0)] + self.interpolate([i * pin_distance_m for i in range(1, num_pins + 1)]) + [self.point(len(self) - 1)]:
+                if not pins or pins[-1] != point: pins.append(point)
+            self._pin_cache[pin_distance_m] = pins
+        return list(pins)
+
+class TrackDatabase:
+    # Vector sections of every track node in a route's .tdb, as parallel flat arrays (one entry per section start):
+    # owning track node id, tile x/z and x/z offset. Sections of one node are contiguous and in track order.
+    TILE_SIZE = 2048.0
+    GRID_SIZE = 512.0
+
+    def __init__(self, node_ids, tile_x, tile_z, x, z):
+        self.node_ids = node_ids; self.tile_x = tile_x; self.tile_z = tile_z; self.x = x; self.z = z; self._grid = None
+
+    def __len__(self): return len(self.node_ids)
+
+    def _world(self, tile_x, tile_z, x, z): return (tile_x * self.TILE_SIZE + x, tile_z * self.TILE_SIZE + z)
+
+    def _section_world(self, i): return self._world(float(self.tile_x[i]), float(self.tile_z[i]), float(self.x[i]), float(self.z[i]))
+
+    def _build_grid(self):
+        grid = {}
+        if NUMPY_AVAILABLE:
+            wx = np.asarray(self.tile_x) * self.TILE_SIZE + np.asarray(self.x); wz = np.asarray(self.tile_z) * self.TILE_SIZE + np.asarray(self.z)
+            cells = zip(np.floor(wx / self.GRID_SIZE).astype(np.int64).tolist(), np.floor(wz / self.GRID_SIZE).astype(np.int64).tolist())
+        else:
+            cells = ((math.floor(wx / self.GRID_SIZE), math.floor(wz / self.GRID_SIZE)) for wx, wz in (self._section_world(i) for i in range(len(self))))
+        for i, cell in enumerate(cells): grid.setdefault(cell, []).append(i)
+        self._grid = grid
+
+    def _nearest_by_node(self, point):
+        # For every track node with a section start in the 3x3 grid cells around point: (closest section, distance).
+        if self._grid is None: self._build_grid()
+        cx, cz = math.floor(point[0] / self.GRID_SIZE), math.floor(point[1] / self.GRID_SIZE); best = {}
+        for dx in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                for i in self._grid.get((cx + dx, cz + dz), ()):
+                    sx, sz = self._section_world(i); d = math.hypot(sx - point[0], sz - point[1]); node = int(self.node_ids[i])
+                    if node not in best or d < best[node][1]: best[node] = (i, d)
+        return best
+
+    def sections_between(self, a, b):
+        # Section starts the track passes through between two path points (tile_x, tile_z, x, z), in travel order.
+        # Empty when both points do not sit on one common track node.
+        pa = self._world(*a); pb = self._world(*b)
+        near_a = self._nearest_by_node(pa); near_b = self._nearest_by_node(pb)
+        common = set(near_a) & set(near_b)
+        if not common: return []
+        node = min(common, key=lambda n: near_a[n][1] + near_b[n][1]); ia, ib = near_a[node][0], near_b[node][0]
+        if ia == ib: return []
+        step = 1 if ib > ia else -1; indices = list(range(ia, ib + step, step))
+        def behind(i, j, p):
+            # Section start i lies on the far side of p from its neighbour j (p is between them).
+            si, sj = self._section_world(i), self._section_world(j)
+            return (si[0] - p[0]) * (sj[0] - p[0]) + (si[1] - p[1]) * (sj[1] - p[1]) < 0
+        if len(indices) > 1 and behind(indices[0], indices[1], pa): indices.pop(0)
+        if len(indices) > 1 and behind(indices[-1], indices[-2], pb): indices.pop()
+        return [i for i in indices if min(math.dist(self._section_world(i), pa), math.dist(self._section_world(i), pb)) > 1.0]
+
+class _EncodedWriter:
+    # Text sink used by the atomic writer: encodes and translates newlines itself. When given the current file it
+    # compares as it goes and only opens the temp file at the first differing byte, so an unchanged activity is
+    # never rewritten (or even written to a temp file).
+    def __init__(self, encoding, newline, open_output, existing=None):
+        self._encoder = codecs.getincrementalencoder(encoding)(); self._newline = newline
+        self._open_output = open_output; self._existing = existing; self._matched = 0
+        self.out = open_output() if existing is None else None
+
+    def write(self, text):
+        if self._newline != '\n': text = text.replace('\n', self._newline)
+        self._write_bytes(self._encoder.encode(text))
+
+    def writelines(self, lines):
+        for line in lines: self.write(line)
+
+    def _write_bytes(self, data):
+        if self.out is None:
+            if self._existing.read(len(data)) == data: self._matched += len(data); return
+            self._diverge()
+        self.out.write(data)
+
+    def _diverge(self):
+        self.out = self._open_output(); self._existing.seek(0); remaining = self._matched
+        while remaining:
+            chunk = self._existing.read(min(remaining, 1 << 20)); self.out.write(chunk); remaining -= len(chunk)
+
+    def finish(self):
+        # Returns True if a temp file was written, False if the output matched the existing file exactly.
+        self._write_bytes(self._encoder.encode('', final=True))
+        if self.out is None:
+            if self._existing.read(1) == b'': return False
+            self._diverge()
+        return True
+
 class OpenRailsParser:
     def __init__(self, content_path_str, log_callback=print):
         self.content_path = Path(content_path_str); self.routes_path = self.content_path / "ROUTES"; self.goode = GoodeProjection(); self.log = log_callback
-        self.current_track_nodes = {}
-
-    def _haversine(self, lat1, lon1, lat2, lon2):
-        R = 6371000  # Earth radius in meters
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2)
-        delta_phi = math.radians(lat2 - lat1)
-        delta_lambda = math.radians(lon2 - lon1)
-        a = math.sin(delta_phi / 2) * math.sin(delta_phi / 2) + \
-            math.cos(phi1) * math.cos(phi2) * \
-            math.sin(delta_lambda / 2) * math.sin(delta_lambda / 2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return R * c
-        
+        self.current_track_nodes = None; self._track_nodes_key = None
+        self.activity_index = ActivityIndex(log_callback=log_callback)
+        self.generated = GeneratedFilesManifest(log_callback=log_callback)
+        self.path_cache_dir = Path("path_cache"); self._path_geometry_memo = {}
+
     def _read_file(self, path):
         try:
             with open(path, 'r', encoding='utf-16-le', errors='strict') as f: return f.read(), 'utf-16-le'
@@ -76,9 +363,50 @@ class OpenRailsParser:
                 with open(path, 'r', encoding='utf-8-sig', errors='strict') as f: return f.read(), 'utf-8-sig'
             except Exception: return None, None
         except Exception: return None, None
+    def _detect_newline(self, path, encoding):
+        # _read_file reads with universal newlines, so the file's own line ending is taken from its raw bytes.
+        byte_encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding; width = len('\n'.encode(byte_encoding))
+        try:
+            with open(path, 'rb') as f: head = f.read(65536)
+        except OSError: return os.linesep
+        lf = '\n'.encode(byte_encoding); pos = head.find(lf)
+        while pos != -1 and pos % width: pos = head.find(lf, pos + 1) # Only code-unit aligned matches count
+        if pos == -1: return os.linesep
+        return '\r\n' if pos >= width and head[pos - width:pos] == '\r'.encode(byte_encoding) else '\n'
+    def _find_tdb(self, route_path):
+        route_path = Path(route_path); trk_path = next(route_path.glob("*.trk"), None)
+        tdb_path = trk_path.with_suffix(".tdb") if trk_path else None
+        if tdb_path and tdb_path.exists(): return tdb_path
+        return next(route_path.glob("*.tdb"), None)
     def load_track_nodes_for_route(self, trk_path_str):
-        self.current_track_nodes = {}
-        pass
+        # Parses the track database of the route folder containing trk_path_str (any file in the route folder works)
+        # once per route; later calls for the same unchanged .tdb reuse it.
+        tdb_path = self._find_tdb(Path(trk_path_str).parent)
+        if not tdb_path: self.current_track_nodes = None; self._track_nodes_key = None; return None
+        stat = tdb_path.stat(); cache_key = (os.path.normcase(os.path.abspath(tdb_path)), stat.st_mtime_ns, stat.st_size)
+        if cache_key == self._track_nodes_key: return self.current_track_nodes
+        rows = self._load_cached_rows("tdb_", cache_key, 5)
+        if rows:
+            self.current_track_nodes = TrackDatabase(*rows)
+            self.log(f"[INFO] Loaded cached track database {tdb_path.name}: {len(self.current_track_nodes)} sections.")
+        else:
+            self.log(f"[INFO] Parsing track database: {tdb_path.name}")
+            node_ids, tile_x, tile_z, xs, zs = array('d'), array('d'), array('d'), array('d'), array('d')
+            try:
+                with RouteFileScanner(tdb_path) as scanner:
+                    vector_nodes = [m for m in (_TDB_VECTOR_NODE_PATTERN.search(span) for span in scanner.iter_spans("TrVectorSections", lookbehind=80)) if m]
+            except OSError as e: self.log(f"[ERROR] Could not read track database: {e}"); self.current_track_nodes = None; return None
+            for m in vector_nodes:
+                count = int(m.group(2)); values = m.group(3).split()
+                if not count or len(values) != count * 16: continue
+                for k in range(count):
+                    # SectionIndex ShapeIndex WFNameX WFNameZ WFUiD Flag1 Flag2 "00" TileX TileZ X Y Z AX AY AZ
+                    base = k * 16; node_ids.append(int(m.group(1))); tile_x.append(int(values[base + 8])); tile_z.append(int(values[base + 9])); xs.append(float(values[base + 10])); zs.append(float(values[base + 12]))
+            self.current_track_nodes = TrackDatabase(node_ids, tile_x, tile_z, xs, zs)
+            self._save_cached_rows("tdb_", cache_key, (node_ids, tile_x, tile_z, xs, zs))
+            self.log(f"[INFO] Parsed track database {tdb_path.name}: {len(node_ids)} sections.")
+        self._track_nodes_key = cache_key
+        return self.current_track_nodes
     def get_all_routes(self):
         routes = {}
         if not self.routes_path.is_dir(): return {}
@@ -97,26 +425,76 @@ class OpenRailsParser:
                 route_id = route_id_match.group(1) or route_id_match.group(2)
                 routes[route_name.strip()] = {"id": route_id.strip(), "path": str(trk_path.parent), "trk_path": str(trk_path)}
         return routes
+    def _ensure_generated_manifest(self):
+        # Content folders used before the manifest existed get one full scan, after which the manifest is authoritative.
+        if not self.generated.is_tracked(self.content_path): self.verify_generated_files()
+    def verify_generated_files(self):
+        acts, sounds = [], []
+        if self.content_path.is_dir():
+            acts = list(self.content_path.glob(f"**/*.{APP_SUFFIX}.*.act")); sounds = list(self.content_path.glob("**/SOUND/WEATHERLINK_*.wav"))
+        self.generated.replace(self.content_path, {"act": acts, "sound": sounds})
+        self.log(f"[Info] Verified generated files in '{self.content_path}': {len(acts)} activity file(s), {len(sounds)} sound file(s).")
+        return len(acts), len(sounds)
     def route_has_generated_files(self, route_path_str):
-        route_path = Path(route_path_str)
-        if not route_path.is_dir():
-            return False
-        return any(route_path.glob(f"**/*.{APP_SUFFIX}.*.act"))
+        self._ensure_generated_manifest()
+        return bool(self.generated.get_files(self.content_path, "act", under=route_path_str))
+    def _forget_activity_index_entry(self, act_path):
+        # Generated files copy the original's timestamps, so mtime alone cannot be trusted to invalidate them.
+        self.activity_index.forget(act_path.parent, act_path.name)
+    def _index_entry_is_current(self, entry, stat):
+        return entry is not None and entry.get("mtime") == stat.st_mtime_ns and entry.get("size") == stat.st_size
     def get_activities_for_route(self, route_path_str):
         activities = {}; activities_path = Path(route_path_str) / "ACTIVITIES"
         if not activities_path.is_dir(): return {}
+        old_entries = self.activity_index.folder_entries(activities_path); changed = {}; seen = set()
         for act_path in sorted(activities_path.glob("*.act")):
-            content, _ = self._read_file(act_path)
-            if not content: continue
-            # Regex to find Name(), supporting both "quoted" and unquoted values
-            name_match = re.search(r'\bName\s*\(\s*(?:"([^"]+)"|([^\s\)]+))\s*\)', content, re.IGNORECASE | re.DOTALL)
-            if name_match:
-                activity_name = name_match.group(1) or name_match.group(2)
-                has_weather_version = f".{APP_SUFFIX}." in act_path.name
-                activities[act_path.name] = {"display_name": activity_name.strip(), "path": str(act_path), "has_weather": has_weather_version}
+            try: stat = act_path.stat()
+            except OSError: continue
+            seen.add(act_path.name)
+            entry = old_entries.get(act_path.name)
+            if not self._index_entry_is_current(entry, stat):
+                try:
+                    with RouteFileScanner(act_path) as scanner:
+                        # Regex to find Name(), supporting both "quoted" and unquoted values
+                        name_match = scanner.first_match("Name", _ACTIVITY_LIST_NAME_PATTERN)
+                        header = self._scan_activity_header(scanner) if name_match else None
+                except OSError: continue
+                entry = None
+                if name_match:
+                    entry = {"display_name": (name_match.group(1) or name_match.group(2)).strip(), "path_id": header["path_id"], "season": header["season"], "start_time": header["start_time"],
+                             "has_weather": f".{APP_SUFFIX}." in act_path.name}
+                changed[act_path.name] = (stat.st_mtime_ns, stat.st_size, entry) # None records a file without a Name
+                if entry is None: continue
+            elif entry.get("missing_name"): continue
+            activities[act_path.name] = {"display_name": entry["display_name"], "path": str(act_path), "has_weather": entry["has_weather"], "path_id": entry["path_id"], "season": entry["season"], "start_time": entry["start_time"]}
+        self.activity_index.update_folder(activities_path, changed, [name for name in old_entries if name not in seen])
         return activities
+    def _parse_activity_header(self, content):
+        header = {"path_id": None, "season": 1, "start_time": 0}
+        path_id_match = _PATH_ID_PATTERN.search(content)
+        if path_id_match: header["path_id"] = path_id_match.group(1) or path_id_match.group(2)
+        season_match = _SEASON_PATTERN.search(content)
+        if season_match: header["season"] = int(season_match.group(2))
+        start_time_match = _START_TIME_PATTERN.search(content)
+        if start_time_match:
+            header["start_time"] = int(start_time_match.group(1))
+        return header
+    def _scan_activity_header(self, scanner):
+        header = {"path_id": None, "season": 1, "start_time": 0}
+        path_id_match = scanner.first_match("PathID", _PATH_ID_PATTERN)
+        if path_id_match: header["path_id"] = path_id_match.group(1) or path_id_match.group(2)
+        season_match = scanner.first_match("Season", _SEASON_PATTERN)
+        if season_match: header["season"] = int(season_match.group(2))
+        start_time_match = scanner.first_match("Player_Traffic_Definition", _START_TIME_PATTERN)
+        if start_time_match: header["start_time"] = int(start_time_match.group(1))
+        return header
     def get_activity_details(self, act_path_str):
         details = {"description": "N/A", "briefing": "N/A", "path_id": None, "existing_weather": [], "season": 1, "start_time": 0}
+        act_path = Path(act_path_str)
+        try: stat = act_path.stat()
+        except OSError: return details
+        entry = self.activity_index.get(act_path.parent, act_path.name)
+        if self._index_entry_is_current(entry, stat) and "details" in entry: return dict(entry["details"])
         content, _ = self._read_file(act_path_str)
         if not content: return details
         def extract_text(key):
@@ -124,18 +502,12 @@ class OpenRailsParser:
             if match: return match.group(1).replace('"\n\n"+', '').replace('"\n"+', '\n').strip()
             return f"No {key} found."
         details["description"] = extract_text("Description"); details["briefing"] = extract_text("Briefing")
-        path_id_match = re.search(r'PathID\s*\(\s*(?:"([^"]*)"|(\S+))\s*(?:\s+[0-9]+)?\s*\)', content, re.IGNORECASE)
-        if path_id_match: details["path_id"] = path_id_match.group(1) or path_id_match.group(2)
-        season_match = re.search(r'Season\s*\(\s*(\d)\s*\)', content, re.IGNORECASE)
-        if season_match: details["season"] = int(season_match.group(1))
-        start_time_match = re.search(r'Player_Traffic_Definition\s*\(\s*(\d+)', content, re.IGNORECASE | re.DOTALL)
-        if start_time_match:
-            details["start_time"] = int(start_time_match.group(1))
-        weather_pattern = r'(Event(?:CategoryTime|TypeTime)\s*\(.*?ORTSWeatherChange.*?\)\s*\))'
-        weather_events = re.findall(weather_pattern, content, re.DOTALL | re.IGNORECASE)
+        details.update(self._parse_activity_header(content))
+        weather_events = [block for block, _ in self._iter_weather_blocks(content)]
         if weather_events: 
             details["existing_weather"] = weather_events
-        return details
+        if self._index_entry_is_current(entry, stat): self.activity_index.set_details(act_path.parent, act_path.name, stat.st_mtime_ns, stat.st_size, details)
+        return dict(details)
     def find_route_start_location(self, route_data):
         trk_path = Path(route_data['trk_path']); route_id = route_data['id']
         content, _ = self._read_file(trk_path)
@@ -152,47 +524,87 @@ class OpenRailsParser:
                 self.log(f"[SUCCESS] Calculated coordinates via Goode projection."); return lat, lon
         self.log(f"[ERROR] No coordinate source found for RouteID '{route_id}'."); return None, None
         
-    def get_activity_path_coords(self, route_path_str, path_id):
-        if not path_id: self.log("[INFO] PathID not found in activity file. Cannot draw path."); return [], 0
+    def get_activity_path_geometry(self, route_path_str, path_id):
+        if not path_id: self.log("[INFO] PathID not found in activity file. Cannot draw path."); return None
         pat_path = Path(route_path_str) / "PATHS" / f"{path_id}.pat"
-        if not pat_path.exists(): self.log(f"[ERROR] Path file not found: {pat_path.name}"); return [], 0
+        if not pat_path.exists(): self.log(f"[ERROR] Path file not found: {pat_path.name}"); return None
+        # The geometry depends on the .tdb too, so its stamp is part of the key.
+        tdb_path = self._find_tdb(route_path_str); tdb_stat = tdb_path.stat() if tdb_path else None
+        stat = pat_path.stat(); cache_key = (os.path.normcase(os.path.abspath(pat_path)), stat.st_mtime_ns, stat.st_size, tdb_stat.st_mtime_ns if tdb_stat else 0, tdb_stat.st_size if tdb_stat else 0)
+        geometry = self._path_geometry_memo.get(cache_key)
+        if not geometry:
+            rows = self._load_cached_rows("path_", cache_key, 3)
+            if rows: geometry = PathGeometry(*rows)
+        if geometry:
+            self._path_geometry_memo[cache_key] = geometry
+            self.log(f"[INFO] Loaded cached path geometry for {pat_path.name}: {len(geometry)} nodes, {geometry.total_dist/1000:.2f} km.")
+            return geometry
         self.log(f"[INFO] Parsing activity path: {pat_path.name}")
-        content, _ = self._read_file(pat_path)
-        if not content: self.log(f"[ERROR] Could not read path file."); return [], 0
         pdp_pattern = re.compile(r'TrackPDP\s*\(\s*(-?\d+)\s+(-?\d+)\s+([\d\.-]+)\s+([\d\.-]+)\s+([\d\.-]+)', re.IGNORECASE)
         path_node_pattern = re.compile(r'TrPathNode\s*\(\s*\w+\s+\w+\s+\w+\s+(\d+)\s*\)', re.IGNORECASE)
-        pdp_list = [ {'tile_x': int(m[1]), 'tile_z': int(m[2]), 'offset_x': float(m[3]), 'offset_z': float(m[5])} for m in pdp_pattern.finditer(content) ]
-        path_indices = [int(m.group(1)) for m in path_node_pattern.finditer(content)]
+        try:
+            with RouteFileScanner(pat_path) as scanner:
+                pdp_list = [ (int(m[1]), int(m[2]), float(m[3]), float(m[5])) for m in map(pdp_pattern.match, scanner.iter_spans("TrackPDP")) if m ]
+                path_indices = [int(m.group(1)) for m in map(path_node_pattern.match, scanner.iter_spans("TrPathNode")) if m]
+        except OSError as e: self.log(f"[ERROR] Could not read path file: {e}"); return None
         if not pdp_list or not path_indices:
-            self.log(f"[WARN] No valid path data found in {pat_path.name}"); return [], 0
-        
-        path_coords = []; total_dist = 0.0; last_coords = None
-        
-        full_path_coords = []
-        for pdp_index in path_indices:
-            if pdp_index < len(pdp_list):
-                node_data = pdp_list[pdp_index]
-                lat, lon = self.goode.ConvertWTC(node_data['tile_x'], node_data['tile_z'], node_data['offset_x'], node_data['offset_z'])
-                if lat is not None and lon is not None:
-                    full_path_coords.append((lat, lon))
-        
-        if not full_path_coords: return [], 0
+            self.log(f"[WARN] No valid path data found in {pat_path.name}"); return None
         
-        sample_rate = max(1, len(full_path_coords) // 100)
-        for i, (lat, lon) in enumerate(full_path_coords):
-            if last_coords:
-                dist_segment = self._haversine(last_coords[0], last_coords[1], lat, lon)
-                total_dist += dist_segment
-            
-            if i % sample_rate == 0 or i == len(full_path_coords) - 1:
-                path_coords.append(((lat, lon), total_dist))
-            
-            last_coords = (lat, lon)
-            
-        self.log(f"[INFO] Generated map path with {len(path_coords)} points. Total distance: {total_dist/1000:.2f} km.")
-        return path_coords, total_dist
+        nodes = [pdp_list[pdp_index] for pdp_index in path_indices if pdp_index < len(pdp_list)]
+        if not nodes: self.log(f"[WARN] No path node in {pat_path.name} refers to a valid TrackPDP."); return None
+        track_db = self.load_track_nodes_for_route(str(tdb_path)) if tdb_path else None
+        if track_db:
+            # Follow the track: insert the vector section starts the train passes between consecutive path nodes.
+            points = nodes[:1]
+            for a, b in zip(nodes, nodes[1:]):
+                points.extend((int(track_db.tile_x[i]), int(track_db.tile_z[i]), float(track_db.x[i]), float(track_db.z[i])) for i in track_db.sections_between(a, b))
+                points.append(b)
+            self.log(f"[INFO] Path follows track database geometry: {len(nodes)} path nodes expanded to {len(points)} points.")
+            nodes = points
+        lats, lons = self.goode.ConvertWTC_Batch(*zip(*nodes))
+        valid = [i for i in range(len(nodes)) if not (math.isnan(lats[i]) or math.isnan(lons[i]))]
+        if not valid: return None
+        geometry = PathGeometry.from_coords([lats[i] for i in valid], [lons[i] for i in valid])
+        self._path_geometry_memo[cache_key] = geometry; self._save_cached_rows("path_", cache_key, (geometry.lats, geometry.lons, geometry.cum_dist))
+        self.log(f"[INFO] Parsed path with {len(geometry)} nodes. Total distance: {geometry.total_dist/1000:.2f} km.")
+        return geometry
+
+    def _cache_file(self, prefix, cache_key):
+        # <prefix><hash of source path>_<stamps>.npy (or .bin when NumPy is unavailable). Stamps are the source mtime/size.
+        path_hash = prefix + hashlib.sha1(cache_key[0].encode('utf-8')).hexdigest()[:16]
+        stamps = "_".join(str(v) for v in cache_key[1:])
+        return self.path_cache_dir / f"{path_hash}_{stamps}.{'npy' if NUMPY_AVAILABLE else 'bin'}", path_hash
+
+    def _load_cached_rows(self, prefix, cache_key, row_count):
+        cache_file, _ = self._cache_file(prefix, cache_key)
+        if not cache_file.exists(): return None
+        try:
+            if NUMPY_AVAILABLE:
+                data = np.load(cache_file, mmap_mode='r')
+                return [data[i] for i in range(row_count)]
+            values = array('d')
+            with open(cache_file, 'rb') as f: values.frombytes(f.read())
+            n = len(values) // row_count
+            return [values[i * n:(i + 1) * n] for i in range(row_count)]
+        except (OSError, ValueError) as e:
+            self.log(f"[WARN] Ignoring unreadable cache {cache_file.name}: {e}"); return None
+
+    def _save_cached_rows(self, prefix, cache_key, rows):
+        cache_file, path_hash = self._cache_file(prefix, cache_key)
+        try:
+            self.path_cache_dir.mkdir(exist_ok=True)
+            for stale in self.path_cache_dir.glob(f"{path_hash}_*"):
+                try: stale.unlink()
+                except OSError: pass # Still memory-mapped elsewhere; it will be replaced next time
+            tmp_file = cache_file.with_suffix(".tmp")
+            with open(tmp_file, 'wb') as f:
+                if NUMPY_AVAILABLE: np.save(f, np.vstack([np.asarray(row, dtype=np.float64) for row in rows]))
+                else: array('d', [v for row in rows for v in row]).tofile(f)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            self.log(f"[WARN] Could not write cache {cache_file.name}: {e}")
 
-    def modify_and_save_activity(self, original_path_str, act_events_content, date_obj=None, chaotic=False, manual_suffix=None, season=None, metar_station=None):
+    def modify_and_save_activity(self, original_path_str, act_events_content, date_obj=None, chaotic=False, manual_suffix=None, season=None, metar_station=None, incremental=False):
         original_path = Path(original_path_str)
         try:
             if manual_suffix:
@@ -208,18 +620,18 @@ class OpenRailsParser:
             
             base_stem = re.split(fr'\.{APP_SUFFIX}\.', original_path.stem)[0]
             new_path = original_path.parent / f"{base_stem}.{filename_suffix}.act"
+            if incremental and new_path.is_file(): return self.update_wthlink_activity(new_path, act_events_content, season)
 
-            shutil.copy2(original_path, new_path)
-            self.log(f"  > Created safe copy: {new_path.name}")
-            new_content, original_encoding = self._read_file(new_path)
-            if not new_content: return None, "Failed to read the newly created copy."
+            new_content, original_encoding = self._read_file(original_path)
+            if not new_content: return None, "Failed to read the original activity file."
+            self.log(f"  > Writing new activity: {new_path.name}")
             
+            # Every change is collected as a (start, end, replacement) span and streamed out in one pass.
+            edits = []
             # More robust pattern to find Name(), supporting both "quoted" and unquoted values
-            name_search_pattern = re.compile(r'(\bName\s*\(\s*(?:"([^"]+)"|([^\s\)]+))\s*\))', re.IGNORECASE)
-            name_match = name_search_pattern.search(new_content)
+            name_match = _ACTIVITY_NAME_PATTERN.search(new_content)
 
             if name_match:
-                original_block = name_match.group(1)
                 quoted_name = name_match.group(2)
                 unquoted_name = name_match.group(3)
 
@@ -228,70 +640,186 @@ class OpenRailsParser:
                 new_activity_name = f"{original_name_str}{name_suffix}"
                 
                 # Reconstruct the block, preserving quotes if they were used
-                if quoted_name is not None:
-                    indent = re.match(r'(\s*)', original_block).group(1)
-                    new_block = f'{indent}Name ( "{new_activity_name}" )'
-                else:
-                    indent = re.match(r'(\s*)', original_block).group(1)
-                    new_block = f'{indent}Name ( {new_activity_name} )'
-                
-                new_content = new_content.replace(original_block, new_block, 1)
+                new_block = f'Name ( "{new_activity_name}" )' if quoted_name is not None else f'Name ( {new_activity_name} )'
+                edits.append((name_match.start(1), name_match.end(1), new_block))
                 self.log(f"  > Renamed activity to: \"{new_activity_name}\"")
             else:
                 self.log("  > WARNING: Could not find activity Name() to rename.")
 
             if season is not None:
-                season_pattern = re.compile(r'(\bSeason\s*\(\s*)(\d)(\s*\))', re.IGNORECASE)
-                if season_pattern.search(new_content):
-                    new_content = season_pattern.sub(fr'\g<1>{season}\g<3>', new_content, count=1)
+                season_match = _SEASON_PATTERN.search(new_content)
+                if season_match:
+                    edits.append((season_match.start(2), season_match.end(2), str(season)))
                     self.log(f"  > Changed season to: {season}")
 
-            events_match = re.search(r'(\bEvents\s*\(\s*)(.*?)(\s*\)\s*\))', new_content, re.IGNORECASE | re.DOTALL)
-            if not events_match:
+            events_block = self._scan_events_block(new_content)
+            if not events_block:
                 self.log("  > WARNING: 'Events ()' block not found. Appending a new one to the end of the file.")
-                last_paren_match = re.search(r'(\s*\)\s*)$', new_content, re.DOTALL)
-                if last_paren_match:
-                    insertion_point = last_paren_match.start(1)
-                    new_events_block = f"\n\tEvents (\n{act_events_content}\n\t)"
-                    final_content = new_content[:insertion_point] + new_events_block + new_content[insertion_point:]
+                end = len(new_content)
+                while end and new_content[end - 1].isspace(): end -= 1
+                if end and new_content[end - 1] == ')':
+                    insertion_point = end - 1
+                    while insertion_point and new_content[insertion_point - 1].isspace(): insertion_point -= 1
+                    edits.append((insertion_point, insertion_point, self._event_chunks(act_events_content, "\n\tEvents (\n", "\n\t)")))
                 else:
                     return None, "Could not find the end of the Activity file to add Events block."
             else:
-                clean_events_content = re.sub(r'\s*EventCategoryTime\s*\(\s*Name\s*\(\s*WTHLINK_.*?\)\s*.*?\)', '', events_match.group(2), flags=re.DOTALL | re.IGNORECASE).strip()
-                final_content = f"{new_content[:events_match.start(2)]}\n{act_events_content}\n{clean_events_content}\n\t{new_content[events_match.end(2):]}"
+                inner_start, _, children = events_block
+                edits.append((inner_start, inner_start, self._event_chunks(act_events_content, "\n")))
+                for block_name, block_start, block_end in children:
+                    if block_name.lower() != 'eventcategorytime' or not _WTHLINK_EVENT_NAME_PATTERN.search(new_content, block_start, block_end): continue
+                    while block_start > inner_start and new_content[block_start - 1].isspace(): block_start -= 1
+                    edits.append((block_start, block_end, ""))
 
-            with open(new_path, 'w', encoding=original_encoding) as f: f.write(final_content)
+            written = self._write_atomic(new_path, original_encoding, lambda f: self._write_spliced(f, new_content, edits), stat_source=original_path, skip_if_identical=True, newline=self._detect_newline(original_path, original_encoding))
+            self.generated.record(self.content_path, "act", new_path)
+            if not written:
+                self.log(f"  > {new_path.name} already has identical content; left untouched.")
+                return new_path, "Activity file is already up to date."
+            self._forget_activity_index_entry(new_path)
             return new_path, "New activity file created successfully!"
         except Exception as e: return None, f"Error saving files: {e}"
 
-    def cleanup_generated_files(self, search_path_str):
+    def update_wthlink_activity(self, act_path_str, act_events_content, season=None):
+        # Refreshes an already generated activity, touching only the WTHLINK events whose text changed. The edits are
+        # spliced into a fresh copy that replaces the file atomically, keeping the file's own line endings.
+        act_path = Path(act_path_str)
+        try:
+            content, encoding = self._read_file(act_path)
+            if not content: return None, "Failed to read the existing activity file."
+            events_block = self._scan_events_block(content)
+            if not events_block: return None, "Existing activity has no Events block to update."
+            inner_start, _, children = events_block
+
+            existing = {}
+            for block_name, block_start, block_end in children:
+                if block_name.lower() != 'eventcategorytime': continue
+                name_match = _WTHLINK_EVENT_NAME_PATTERN.search(content, block_start, block_end)
+                if name_match: existing.setdefault(name_match.group(1), []).append((block_start, block_end))
+
+            lines = act_events_content.split("\n") if isinstance(act_events_content, str) else iter_event_lines(act_events_content)
+            edits = []; total = changed = inserted = 0
+            for line in lines:
+                name_match = _WTHLINK_EVENT_NAME_PATTERN.search(line)
+                if not name_match: continue
+                total += 1; spans = existing.get(name_match.group(1))
+                if not spans: edits.append((inner_start, inner_start, f"\n{line}")); inserted += 1; continue
+                block_start, block_end = spans.pop(0)
+                if content[block_start:block_end].split() != line.split():
+                    edits.append((block_start, block_end, line.strip())); changed += 1
+            removed = 0
+            for spans in existing.values():
+                for block_start, block_end in spans:
+                    while block_start > inner_start and content[block_start - 1].isspace(): block_start -= 1
+                    edits.append((block_start, block_end, "")); removed += 1
+            if season is not None:
+                season_match = _SEASON_PATTERN.search(content)
+                if season_match and season_match.group(2) != str(season): edits.append((season_match.start(2), season_match.end(2), str(season)))
+
+            if not edits:
+                self.log(f"  > {act_path.name}: all {total} events unchanged; left untouched.")
+                return act_path, "Activity file is already up to date."
+            self.log(f"  > Updating {act_path.name}: {changed} changed, {inserted} added, {removed} removed ({total} events in the new timeline).")
+            self._write_atomic(act_path, encoding, lambda f: self._write_spliced(f, content, edits), stat_source=act_path, newline=self._detect_newline(act_path, encoding))
+            self._forget_activity_index_entry(act_path)
+            self.generated.record(self.content_path, "act", act_path)
+            return act_path, f"Activity updated: {changed + inserted + removed} event(s) changed."
+        except Exception as e: return None, f"Error updating activity: {e}"
+
+    def _iter_weather_blocks(self, content):
+        # Yields (block text, WeatherChange) for every timed event in the Events block that changes the weather.
+        events_block = self._scan_events_block(content)
+        if not events_block: return
+        for block_name, block_start, block_end in events_block[2]:
+            if block_name.lower() not in ('eventcategorytime', 'eventtypetime'): continue
+            block = content[block_start:block_end]; event = parse_weather_event(block)
+            if event: yield block, event
+
+    def _iter_weather_events(self, content):
+        for _, event in self._iter_weather_blocks(content): yield event
+
+    def _scan_events_block(self, content):
+        # One parenthesis-depth pass over the file (quoted strings are skipped). Returns the inner span of the
+        # first Events ( ... ) block and (name, start, end) for each of its direct children, or None.
+        depth = 0; events_depth = None; inner_start = None; children = []; child = None
+        for m in _BLOCK_TOKEN_PATTERN.finditer(content):
+            token = m.group(0)
+            if token[0] == '"': continue
+            if token[-1] == '(':
+                depth += 1
+                if events_depth is None:
+                    if (m.group(1) or "").lower() == 'events': events_depth = depth; inner_start = m.end()
+                elif depth == events_depth + 1: child = (m.group(1) or "", m.start())
+            else:
+                if events_depth is not None:
+                    if depth == events_depth + 1 and child: children.append((child[0], child[1], m.end())); child = None
+                    elif depth == events_depth: return inner_start, m.start(), children
+                depth -= 1
+        return None
+
+    def _write_atomic(self, target_path, encoding, write_body, stat_source=None, skip_if_identical=False, newline=os.linesep):
+        # Write next to the target, fsync, then rename over it, so a failure never leaves a half-written .act behind.
+        # Returns False when skip_if_identical is set and the target already holds exactly these bytes.
+        tmp = {}
+        def open_output():
+            fd, tmp["name"] = tempfile.mkstemp(prefix=f".{target_path.name}.", suffix=".tmp", dir=target_path.parent)
+            tmp["file"] = os.fdopen(fd, 'wb'); return tmp["file"]
+        try:
+            with contextlib.ExitStack() as stack:
+                existing = stack.enter_context(open(target_path, 'rb')) if skip_if_identical and target_path.is_file() else None
+                writer = _EncodedWriter(encoding, newline, open_output, existing)
+                write_body(writer)
+                if not writer.finish(): return False
+            with tmp["file"] as f: f.flush(); os.fsync(f.fileno())
+            if stat_source: shutil.copystat(stat_source, tmp["name"])
+            os.replace(tmp["name"], target_path)
+            return True
+        except BaseException:
+            if "file" in tmp: tmp["file"].close()
+            if "name" in tmp:
+                try: os.unlink(tmp["name"])
+                except OSError: pass
+            raise
+
+    def _write_spliced(self, f, content, edits):
+        pos = 0
+        for start, end, replacement in sorted(edits, key=lambda e: (e[0], e[1])):
+            f.write(content[pos:start]); pos = end
+            if isinstance(replacement, str): f.write(replacement)
+            else: f.writelines(replacement)
+        f.write(content[pos:])
+
+    def _event_chunks(self, events, prefix="", suffix=""):
+        # Events arrive either as ready-made text or as event records, which are rendered straight into the file.
+        if isinstance(events, str): return f"{prefix}{events}{suffix}"
+        def chunks():
+            yield prefix
+            for i, line in enumerate(iter_event_lines(events)): yield line if i == 0 else f"\n{line}"
+            yield suffix
+        return chunks()
+
+    def cleanup_generated_files(self, search_path_str, verify=False):
         search_path = Path(search_path_str)
         if not search_path.is_dir():
             return 0, 0
+        if verify: self.verify_generated_files()
+        else: self._ensure_generated_manifest()
 
-        act_pattern = f"*.{APP_SUFFIX}.*.act"
-        files_to_delete = list(search_path.glob(f"**/{act_pattern}"))
-        deleted_act_count = 0
-        for f in files_to_delete:
-            try:
-                f.unlink()
-                deleted_act_count += 1
-                self.log(f"Deleted activity: {f.name}")
-            except OSError as e:
-                self.log(f"Could not delete {f.name}: {e}")
-
-        sound_pattern = "WEATHERLINK_*.wav"
-        sound_files_to_delete = list(search_path.glob(f"**/SOUND/{sound_pattern}"))
-        deleted_sound_count = 0
-        for f in sound_files_to_delete:
-            try:
-                f.unlink()
-                deleted_sound_count += 1
-                self.log(f"Deleted sound: {f.name}")
-            except OSError as e:
-                self.log(f"Could not delete {f.name}: {e}")
+        counts = {}
+        for kind, label in (("act", "activity"), ("sound", "sound")):
+            counts[kind] = 0; removed = []
+            for f in self.generated.get_files(self.content_path, kind, under=search_path):
+                try:
+                    f.unlink()
+                    counts[kind] += 1; removed.append(f)
+                    self.log(f"Deleted {label}: {f.name}")
+                except FileNotFoundError:
+                    removed.append(f)
+                except OSError as e:
+                    self.log(f"Could not delete {f.name}: {e}")
+            self.generated.forget(self.content_path, kind, removed)
         
-        return deleted_act_count, deleted_sound_count
+        return counts["act"], counts["sound"]
 
     def parse_wthlink_activity(self, act_path_str):
         self.log(f"[INFO] Parsing WTHLINK activity for editing: {act_path_str}")
@@ -300,29 +828,7 @@ class OpenRailsParser:
             return None
 
         events = []
-        event_pattern = re.compile(r'EventCategoryTime\s*\(.*?Name\s*\(\s*WTHLINK_(.*?)\s*\).*?\)', re.DOTALL | re.IGNORECASE)
-        for match in event_pattern.finditer(content):
-            event_block = match.group(0)
-            
-            time_match = re.search(r'Time\s*\(\s*(\d+)\s*\)', event_block)
-            time = int(time_match.group(1)) if time_match else 0
-
-            weather_change_match = re.search(r'ORTSWeatherChange\s*\((.*?)\)', event_block, re.DOTALL | re.IGNORECASE)
-            if weather_change_match:
-                weather_content = weather_change_match.group(1)
-                
-                def get_val(param):
-                    m = re.search(fr'{param}\s*\(\s*([\d\.-]+)', weather_content, re.IGNORECASE)
-                    return float(m.group(1)) if m else 0.0
-
-                overcast = get_val('ORTSOvercast') * 100
-                fog = get_val('ORTSFog')
-                precip = get_val('ORTSPrecipitationIntensity') * 1000
-                liquidity = get_val('ORTSPrecipitationLiquidity')
-                
-                trans_m = re.search(r'ORTSOvercast\s*\(\s*[\d\.-]+\s+(\d+)', weather_content, re.IGNORECASE)
-                transition = int(trans_m.group(1)) if trans_m else 30
-
-                events.append({'type': 'weather', 'time': time, 'overcast': overcast, 'fog': fog, 'precip': precip, 'liquidity': liquidity, 'transition': transition})
+        for event in self._iter_weather_events(content):
+            if event.name and event.name.upper().startswith(f"{APP_SUFFIX}_"): events.append(event.to_editor_dict())
         
         return sorted(events, key=lambda x: x['time'])
\ No newline at end of file
@@ -0,0 +1,75 @@
+# preset_store.py
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+class PresetStore:
+    # User presets for the manual editor, one SQLite row each, so saving, renaming or deleting a preset touches only
+    # that row and listing names never loads event sequences. Every call opens its own short-lived connection and
+    # SQLite serialises writers, so the editor and the main window (or their worker threads) can write at once.
+    def __init__(self, db_file="user_presets.db", legacy_file="user_presets.json", log_callback=print):
+        self.db_path = Path(db_file); self.legacy_path = Path(legacy_file); self.log = log_callback
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                with conn: conn.execute("CREATE TABLE IF NOT EXISTS presets (name TEXT PRIMARY KEY, season INTEGER NOT NULL, events TEXT NOT NULL, updated REAL NOT NULL)")
+            self._import_legacy()
+        except sqlite3.Error as e: self.log(f"[ERROR] Could not open presets database: {e}")
+
+    def _connect(self):
+        return sqlite3.connect(str(self.db_path), timeout=10)
+
+    def _import_legacy(self):
+        # One-time import of the old whole-file user_presets.json; the file is kept as a .bak afterwards.
+        if not self.legacy_path.exists(): return
+        try:
+            with open(self.legacy_path, 'r') as f: legacy = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            self.log(f"[WARN] Could not read legacy presets file {self.legacy_path.name}: {e}"); return
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO presets (name, season, events, updated) VALUES (?, ?, ?, ?)",
+                             [(name, int(p.get("season", 1)), json.dumps(p.get("events", [])), now) for name, p in legacy.items() if isinstance(p, dict)])
+        try: os.replace(self.legacy_path, self.legacy_path.with_name(self.legacy_path.name + ".bak"))
+        except OSError: pass
+        self.log(f"[Info] Imported {len(legacy)} preset(s) from {self.legacy_path.name}.")
+
+    def _fetch(self, query, params=()):
+        # Reads never raise; an unreadable database behaves as an empty one.
+        try:
+            with closing(self._connect()) as conn: return conn.execute(query, params).fetchall()
+        except sqlite3.Error as e: self.log(f"[ERROR] Could not read presets database: {e}"); return []
+
+    def names(self):
+        return [row[0] for row in self._fetch("SELECT name FROM presets ORDER BY name")]
+
+    def __contains__(self, name):
+        return bool(self._fetch("SELECT 1 FROM presets WHERE name = ?", (name,)))
+
+    def __bool__(self):
+        return bool(self._fetch("SELECT 1 FROM presets LIMIT 1"))
+
+    def get(self, name):
+        # Returns {"season": int, "events": [...]} or None.
+        rows = self._fetch("SELECT season, events FROM presets WHERE name = ?", (name,))
+        return {"season": rows[0][0], "events": json.loads(rows[0][1])} if rows else None
+
+    def upsert(self, name, season, events):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("INSERT INTO presets (name, season, events, updated) VALUES (?, ?, ?, ?) ON CONFLICT(name) DO UPDATE SET season = excluded.season, events = excluded.events, updated = excluded.updated",
+                         (name, int(season), json.dumps(list(events)), time.time()))
+
+    def rename(self, old_name, new_name):
+        # Returns False if new_name is already taken; raises KeyError if old_name no longer exists.
+        try:
+            with closing(self._connect()) as conn, conn:
+                renamed = conn.execute("UPDATE presets SET name = ?, updated = ? WHERE name = ?", (new_name, time.time(), old_name)).rowcount == 1
+        except sqlite3.IntegrityError: return False
+        if not renamed: raise KeyError(old_name)
+        return True
+
+    def delete(self, name):
+        with closing(self._connect()) as conn, conn: conn.execute("DELETE FROM presets WHERE name = ?", (name,))
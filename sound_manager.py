@@ -6,65 +6,209 @@ import random
 import shutil
 import json
 import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from generated_manifest import GeneratedFilesManifest
+from sound_renderer import AmbientLoopRenderer, SoundCompactor, RENDERED_NAME_PATTERN
+
+try:
+    import fcntl
+    FICLONE = 0x40049409 if os.uname().sysname == "Linux" else None
+except (ImportError, AttributeError):
+    FICLONE = None
 
 class SoundManager:
+    AMBIENT_LOOP_SECONDS = 900
     def __init__(self, log_callback=print):
         self.log = log_callback
         self.base_path = Path("user_sounds")
         self.sound_definitions = []
         self.sounds = {}
         self.copied_sounds = set()
+        self.generated = GeneratedFilesManifest(log_callback=log_callback)
+        self.metadata_path = Path("sound_cache.json")
+        self._metadata = self._load_metadata(); self._metadata_lock = threading.Lock()
+        self._hash_pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="sound-hash")
+        self._pending_hashes = set()
+        self._deployed = {} # Deployed file name -> known copies in route SOUND folders
+        self.renderer = AmbientLoopRenderer(log_callback=log_callback); self.render_ambient_loops = False # Long loops cost disk space per route
+        self.compactor = SoundCompactor(log_callback=log_callback); self.compact_sounds = False # Deploy downmixed/resampled copies
+        for path in self.generated.all_files("sound"): self._deployed.setdefault(path.name, []).append(path)
+        self._discovery_lock = threading.Lock(); self._snapshots = {}; self._definitions_stamp = None
+        self._stop_watching = threading.Event()
         self.log("[Debug] SoundManager initialized.")
-        self.discover_sounds()
+        # Discovery runs off the UI thread; anything that needs the sound library waits on self.ready.
+        self._discovery_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sound-discovery")
+        self.ready = self._discovery_pool.submit(self.discover_sounds)
+        self._watcher = threading.Thread(target=self._watch, name="sound-watcher", daemon=True); self._watcher.start()
+
+    def wait_until_ready(self, timeout=None):
+        try: self.ready.result(timeout)
+        except Exception as e: self.log(f"[ERROR] Sound discovery failed: {e}")
+
+    def rescan(self):
+        # Full rediscovery in the background (Settings > Rescan); returns the future that completes it.
+        self.ready = self._discovery_pool.submit(self.discover_sounds)
+        return self.ready
+
+    def stop(self):
+        self._stop_watching.set(); self._discovery_pool.shutdown(wait=False); self._hash_pool.shutdown(wait=False)
 
     def _load_definitions(self):
         definitions_path = Path("sounds.json")
         self.log(f"[Debug] Loading sound definitions from '{definitions_path}'")
+        self._definitions_stamp = self._definitions_file_stamp()
         if not definitions_path.exists():
             self.log(f"[ERROR] CRITICAL: '{definitions_path}' not found. No sounds will be loaded.")
-            return
+            return []
         try:
             with open(definitions_path, 'r') as f:
-                self.sound_definitions = json.load(f)
-            self.log(f"[Info] Loaded {len(self.sound_definitions)} sound definitions.")
+                definitions = json.load(f)
+            self.log(f"[Info] Loaded {len(definitions)} sound definitions.")
+            return definitions
         except json.JSONDecodeError as e:
             self.log(f"[ERROR] CRITICAL: Failed to parse '{definitions_path}'. Error: {e}")
         except Exception as e:
             self.log(f"[ERROR] CRITICAL: Could not read '{definitions_path}'. Reason: {e}")
+        return None
+
+    def _definitions_file_stamp(self):
+        try: stat = Path("sounds.json").stat(); return (stat.st_mtime_ns, stat.st_size)
+        except OSError: return None
+
+    def _category_snapshot(self, definition):
+        snapshot = []
+        for sound_file in self.base_path.glob(definition.get("pattern")):
+            try: stat = sound_file.stat()
+            except OSError: continue
+            snapshot.append((sound_file.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(sorted(snapshot))
 
     def discover_sounds(self):
-        self._load_definitions()
-        self.log("[Debug] Discovering user sound files based on definitions...")
-        if not self.base_path.is_dir():
-            self.log(f"[Info] User sounds directory not found. Creating at: '{self.base_path.resolve()}'")
-            self.base_path.mkdir()
-        
-        self.sounds.clear()
-        for definition in self.sound_definitions:
-            category = definition.get("category")
-            pattern = definition.get("pattern")
-            if not category or not pattern: continue
-
-            self.sounds[category] = []
-            self.log(f"[Debug] Searching for '{pattern}' for category '{category}'")
-            found_files = list(self.base_path.glob(pattern))
+        with self._discovery_lock:
+            definitions = self._load_definitions()
+            if definitions is not None: self.sound_definitions = definitions
+            self.log("[Debug] Discovering user sound files based on definitions...")
+            if not self.base_path.is_dir():
+                self.log(f"[Info] User sounds directory not found. Creating at: '{self.base_path.resolve()}'")
+                self.base_path.mkdir()
             
-            for sound_file in found_files:
-                duration = self._get_wav_duration(sound_file)
-                file_hash = self._calculate_hash(sound_file)
-                if duration and file_hash:
-                    self.sounds[category].append({
-                        "path": sound_file, "duration": duration,
-                        "sound_type": definition.get("sound_type", "Everywhere"),
-                        "hash": file_hash
-                    })
-            self.log(f"[Info] Found {len(self.sounds[category])} file(s) for category '{category}'.")
-
-    def _get_wav_duration(self, wav_path):
+            sounds = {}; self._snapshots = {}
+            for definition in self.sound_definitions:
+                category = definition.get("category")
+                if not category or not definition.get("pattern"): continue
+                sounds[category] = self._discover_category(definition)
+            self.sounds = sounds
+            self._finish_discovery()
+
+    def refresh_changed(self):
+        # Rescans only the categories whose definition or matching files changed since the last scan.
+        with self._discovery_lock:
+            old_definitions = {d.get("category"): d for d in self.sound_definitions}
+            if self._definitions_file_stamp() != self._definitions_stamp:
+                definitions = self._load_definitions()
+                if definitions is not None: self.sound_definitions = definitions
+            if not self.base_path.is_dir(): return []
+            sounds = dict(self.sounds); changed = []
+            current = {d.get("category"): d for d in self.sound_definitions if d.get("category") and d.get("pattern")}
+            for category in [c for c in sounds if c not in current]:
+                del sounds[category]; self._snapshots.pop(category, None); changed.append(category)
+            for category, definition in current.items():
+                if category in sounds and old_definitions.get(category) == definition and self._snapshots.get(category) == self._category_snapshot(definition): continue
+                sounds[category] = self._discover_category(definition); changed.append(category)
+            if changed:
+                self.sounds = sounds
+                self.log(f"[Info] Sound library changed; rescanned: {', '.join(sorted(changed))}.")
+                self._finish_discovery()
+            return changed
+
+    def _watch(self, interval=5.0):
+        if not self._stop_watching.wait(0): self.wait_until_ready()
+        while not self._stop_watching.wait(interval):
+            try: self.refresh_changed()
+            except Exception as e: self.log(f"[WARN] Sound folder check failed: {e}")
+
+    def _discover_category(self, definition):
+        category = definition.get("category"); pattern = definition.get("pattern")
+        self.log(f"[Debug] Searching for '{pattern}' for category '{category}'")
+        self._snapshots[category] = self._category_snapshot(definition)
+        found = []
+        for sound_file in self.base_path.glob(pattern):
+            metadata = self._get_metadata(sound_file)
+            if metadata and metadata["duration"]:
+                sound = {
+                    "path": sound_file, "duration": metadata["duration"],
+                    "sound_type": definition.get("sound_type", "Everywhere"),
+                    "hash": metadata["hash"], "format": metadata["format"]
+                }
+                found.append(sound)
+                if sound["hash"] is None: self._hash_in_background(sound_file, sound)
+        self.log(f"[Info] Found {len(found)} file(s) for category '{category}'.")
+        return found
+
+    def _finish_discovery(self):
+        with self._metadata_lock:
+            # Forget files that no longer match any definition.
+            seen = {str(sound["path"].resolve()) for sounds in self.sounds.values() for sound in sounds}
+            for key in [k for k in self._metadata if k not in seen]: del self._metadata[key]
+            pending = len(self._pending_hashes)
+            if not pending: self._save_metadata()
+        if pending: self.log(f"[Info] Hashing {pending} new or changed sound file(s) in the background.")
+
+    def _load_metadata(self):
+        try:
+            with open(self.metadata_path, 'r') as f: return json.load(f)
+        except (OSError, json.JSONDecodeError): return {}
+
+    def _save_metadata(self):
+        # Callers hold _metadata_lock.
+        try:
+            tmp_path = self.metadata_path.with_name(self.metadata_path.name + ".tmp")
+            with open(tmp_path, 'w') as f: json.dump(self._metadata, f, indent=2)
+            os.replace(tmp_path, self.metadata_path)
+        except OSError as e: self.log(f"[WARN] Could not save sound metadata cache: {e}")
+
+    def _get_metadata(self, sound_file):
+        # Duration, format and hash for a WAV, served from sound_cache.json while its mtime and size are unchanged.
+        # New or changed files get their header read here; their hash is filled in later by the hashing pool.
+        try: stat = sound_file.stat()
+        except OSError as e: self.log(f"[ERROR] Could not read sound file {sound_file.name}: {e}"); return None
+        key = str(sound_file.resolve())
+        with self._metadata_lock:
+            entry = self._metadata.get(key)
+            if entry and entry.get("mtime_ns") == stat.st_mtime_ns and entry.get("size") == stat.st_size: return entry
+        wav_format = self._read_wav_format(sound_file)
+        if not wav_format: return None
+        entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "duration": wav_format.pop("duration"), "format": wav_format, "hash": None}
+        with self._metadata_lock: self._metadata[key] = entry
+        return entry
+
+    def _hash_in_background(self, sound_file, sound):
+        key = str(sound_file.resolve())
+        def finished(future):
+            file_hash = future.result()
+            with self._metadata_lock:
+                sound["hash"] = file_hash
+                entry = self._metadata.get(key)
+                if entry is not None and file_hash: entry["hash"] = file_hash
+                self._pending_hashes.discard(future)
+                if not self._pending_hashes: self._save_metadata()
+        future = self._hash_pool.submit(self._calculate_hash, sound_file)
+        with self._metadata_lock: self._pending_hashes.add(future)
+        future.add_done_callback(finished)
+
+    def wait_for_hashes(self):
+        with self._metadata_lock: pending = list(self._pending_hashes)
+        if pending: wait(pending)
+
+    def _read_wav_format(self, wav_path):
         try:
             with contextlib.closing(wave.open(str(wav_path), 'r')) as f:
-                return f.getnframes() / float(f.getframerate())
-        except wave.Error as e:
+                return {"duration": f.getnframes() / float(f.getframerate()), "channels": f.getnchannels(),
+                        "sample_width": f.getsampwidth(), "frame_rate": f.getframerate(), "frames": f.getnframes()}
+        except (wave.Error, EOFError, OSError) as e:
             self.log(f"[ERROR] Could not read duration from .wav file: {wav_path.name} - {e}")
             return None
     
@@ -81,22 +225,101 @@ class SoundManager:
             self.log(f"[ERROR] Could not calculate hash for {filepath.name}: {e}")
             return None
 
+    def library_signature(self):
+        # Hash of the definitions and every discovered file's content hash; changes whenever the sound library does.
+        self.wait_until_ready(); self.wait_for_hashes()
+        hasher = hashlib.sha256(json.dumps(self.sound_definitions, sort_keys=True, default=str).encode('utf-8'))
+        for category in sorted(self.sounds):
+            for sound in sorted(self.sounds[category], key=lambda s: str(s['path'])):
+                hasher.update(f"{category}|{sound['path']}|{sound['hash']}|{sound['duration']}|{sound['sound_type']}\n".encode('utf-8'))
+        if self.compact_sounds: hasher.update(f"compact|{self.compactor.format_tag}".encode('utf-8')) # Deployed names differ
+        if self.render_ambient_loops: hasher.update(f"loops|{self.AMBIENT_LOOP_SECONDS}".encode('utf-8')) # Different timelines
+        return hasher.hexdigest()
+
     def get_sounds_for_condition(self, condition):
         return [s['category'] for s in self.sound_definitions if s['condition'] == condition]
 
+    def ambient_playlist(self, category):
+        # The sounds to cycle through for a continuous (non-thunder) category. When its clips are shorter than
+        # AMBIENT_LOOP_SECONDS they are pre-rendered into one crossfaded loop, so a few long events replace many short ones.
+        clips = self.sounds.get(category, [])
+        if not self.render_ambient_loops or not clips or max(c['duration'] for c in clips) >= self.AMBIENT_LOOP_SECONDS: return clips
+        self.wait_for_hashes()
+        rendered = self.renderer.render(category, clips, self.AMBIENT_LOOP_SECONDS)
+        if not rendered: return clips
+        path, duration, key = rendered
+        return [{"path": path, "duration": duration, "sound_type": clips[0]['sound_type'], "hash": key}]
+
+    def _hash_for(self, source_path):
+        # Content hash of a library sound; computed on demand if discovery has not hashed it yet.
+        rendered_match = RENDERED_NAME_PATTERN.match(source_path.name)
+        if rendered_match: return rendered_match.group(2) # Rendered loops are named by their input hash
+        self.wait_for_hashes()
+        for sounds in self.sounds.values():
+            for sound in sounds:
+                if sound["path"] == source_path and sound["hash"]: return sound["hash"]
+        metadata = self._get_metadata(source_path)
+        if metadata and metadata["hash"]: return metadata["hash"]
+        file_hash = self._calculate_hash(source_path)
+        if metadata and file_hash:
+            with self._metadata_lock: metadata["hash"] = file_hash
+        return file_hash
+
+    def _find_deployed_copy(self, sound_filename, size, device):
+        # Any already deployed copy of the same content on the same volume, to hard link against.
+        for path in self._deployed.get(sound_filename, []):
+            try: stat = path.stat()
+            except OSError: continue
+            if stat.st_size == size and stat.st_dev == device: return path
+        return None
+
+    def _deploy(self, source_path, destination):
+        # Hard link to an existing deployed copy when possible, else reflink (copy-on-write clone), else a plain copy.
+        # The result is always renamed into place, so a destination is never half-written.
+        size = source_path.stat().st_size
+        tmp_path = destination.with_name(destination.name + ".tmp")
+        try: tmp_path.unlink()
+        except OSError: pass
+        existing = self._find_deployed_copy(destination.name, size, destination.parent.stat().st_dev)
+        if existing:
+            try: os.link(existing, tmp_path); os.replace(tmp_path, destination); return "linked"
+            except OSError: pass
+        if FICLONE is not None:
+            try:
+                with open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst: fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                shutil.copystat(source_path, tmp_path); os.replace(tmp_path, destination); return "cloned"
+            except OSError:
+                try: tmp_path.unlink()
+                except OSError: pass
+        shutil.copy2(source_path, tmp_path); os.replace(tmp_path, destination); return "copied"
+
     def copy_sound_to_route(self, source_path, route_path_str):
         try:
             route_path = Path(route_path_str)
             sound_folder = route_path / "SOUND"
             sound_folder.mkdir(parents=True, exist_ok=True)
 
-            sound_filename = f"WEATHERLINK_{source_path.name}"
+            # Named by content, so a file already deployed under this name is the same sound and never copied again.
+            file_hash = self._hash_for(source_path)
+            if not file_hash: return None
+            sound_filename = f"WEATHERLINK_{file_hash[:16]}{source_path.suffix.lower()}"
+            deploy_path = source_path
+            if self.compact_sounds and source_path.suffix.lower() == ".wav":
+                deploy_path = self.compactor.convert(source_path, file_hash)
+                if deploy_path != source_path: sound_filename = f"WEATHERLINK_{file_hash[:16]}_{self.compactor.format_tag}.wav"
             destination = sound_folder / sound_filename
             
-            # Use a cache to avoid copying the same file multiple times per run
+            # Use a cache to avoid even checking the same file multiple times per run
             if destination not in self.copied_sounds:
-                shutil.copy2(source_path, destination)
+                try: up_to_date = destination.stat().st_size == deploy_path.stat().st_size
+                except OSError: up_to_date = False
+                if not up_to_date:
+                    method = self._deploy(deploy_path, destination)
+                    self.log(f"[Debug] Deployed {source_path.name} to {route_path.name} ({method}).")
+                self._deployed.setdefault(sound_filename, [])
+                if destination not in self._deployed[sound_filename]: self._deployed[sound_filename].append(destination)
                 self.copied_sounds.add(destination)
+                self.generated.record(GeneratedFilesManifest.content_root_for(route_path), "sound", destination)
 
             return f"..\\\\SOUND\\\\{sound_filename}"
         except Exception as e:
@@ -0,0 +1,172 @@
+# sound_renderer.py
+import wave
+import contextlib
+import hashlib
+import json
+import random
+import os
+import re
+from array import array
+from itertools import accumulate
+from pathlib import Path
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+_SAMPLE_TYPES = {1: 'B', 2: 'h', 4: 'i'} # WAV sample width (bytes) -> array typecode; 8-bit WAV is unsigned
+_NUMPY_TYPES = {1: '<u1', 2: '<i2', 4: '<i4'}
+RENDERED_NAME_PATTERN = re.compile(r'^AMBIENT_(.+)_([0-9a-f]{16})\.wav$') # Category name, then the input hash prefix
+
+class AmbientLoopRenderer:
+    # Stitches a category's short clips into one long WAV, crossfading each join, so generation can schedule a
+    # handful of long sounds instead of one event per clip. Rendered files are cached by a hash of their inputs.
+    def __init__(self, cache_dir="rendered_sounds", log_callback=print):
+        self.cache_dir = Path(cache_dir); self.log = log_callback
+
+    def render_key(self, clips, target_seconds, crossfade_seconds):
+        payload = json.dumps([sorted(c["hash"] for c in clips), target_seconds, crossfade_seconds])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def render(self, name, clips, target_seconds, crossfade_seconds=2.0):
+        # Returns (path, duration, key) of the rendered loop, or None if the clips cannot be stitched.
+        clips = [c for c in clips if c.get("hash") and c.get("format") and c["format"].get("sample_width") in _SAMPLE_TYPES]
+        if not clips: return None
+        # Only clips sharing the most common format can be joined sample-for-sample.
+        formats = [(c["format"]["channels"], c["format"]["sample_width"], c["format"]["frame_rate"]) for c in clips]
+        channels, sample_width, frame_rate = max(set(formats), key=formats.count)
+        clips = [c for c, f in zip(clips, formats) if f == (channels, sample_width, frame_rate)]
+
+        key = self.render_key(clips, target_seconds, crossfade_seconds)
+        target = self.cache_dir / f"AMBIENT_{name}_{key[:16]}.wav"
+        if target.is_file():
+            with contextlib.closing(wave.open(str(target), 'rb')) as f: return target, f.getnframes() / float(f.getframerate()), key
+        self.cache_dir.mkdir(exist_ok=True)
+        for stale in self.cache_dir.glob(f"AMBIENT_{name}_*.wav"):
+            stale_match = RENDERED_NAME_PATTERN.match(stale.name) # The glob alone also matches e.g. Rain_Heavy for Rain
+            if stale_match and stale_match.group(1) == name: stale.unlink()
+
+        rng = random.Random(key)
+        fade = max(1, int(crossfade_seconds * frame_rate)) * channels
+        remaining = int(target_seconds * frame_rate) * channels
+        tmp_path = target.with_name(target.name + ".tmp")
+        try:
+            with contextlib.closing(wave.open(str(tmp_path), 'wb')) as out:
+                out.setnchannels(channels); out.setsampwidth(sample_width); out.setframerate(frame_rate)
+                tail = None; playlist = []; used_in_cycle = True
+                while remaining > 0:
+                    if not playlist:
+                        if not used_in_cycle: break # Every clip is shorter than two crossfades
+                        playlist = rng.sample(clips, len(clips)); used_in_cycle = False
+                    samples = self._read_samples(playlist.pop()["path"], sample_width)
+                    if len(samples) <= 2 * fade: continue
+                    used_in_cycle = True
+                    if tail is not None:
+                        samples[:fade] = self._crossfade(tail, samples[:fade], sample_width)
+                    else: samples[:fade] = self._ramp(samples[:fade], sample_width, fade_in=True) # Soft start
+                    if len(samples) > remaining + fade: samples = samples[:remaining + fade]
+                    body, tail = samples[:-fade], samples[-fade:]
+                    out.writeframes(body.tobytes()); remaining -= len(body)
+                if tail is not None: out.writeframes(self._ramp(tail, sample_width, fade_in=False).tobytes())
+            if tail is None: # Nothing was long enough to stitch; never cache an empty loop, the raw clips are used instead
+                tmp_path.unlink()
+                self.log(f"[Info] Clips for '{name}' are too short to render an ambient loop; using them as they are.")
+                return None
+            os.replace(tmp_path, target)
+        except (OSError, wave.Error, EOFError) as e:
+            self.log(f"[ERROR] Could not render ambient loop for '{name}': {e}")
+            try: tmp_path.unlink()
+            except OSError: pass
+            return None
+        with contextlib.closing(wave.open(str(target), 'rb')) as f: duration = f.getnframes() / float(f.getframerate())
+        self.log(f"[Info] Rendered {duration / 60:.1f} min ambient loop for '{name}' from {len(clips)} clip(s).")
+        return target, duration, key
+
+    def _read_samples(self, path, sample_width):
+        with contextlib.closing(wave.open(str(path), 'rb')) as f: data = f.readframes(f.getnframes())
+        samples = array(_SAMPLE_TYPES[sample_width]); samples.frombytes(data[:len(data) - len(data) % samples.itemsize])
+        if samples.itemsize != sample_width: raise wave.Error(f"unsupported sample width {sample_width}")
+        return samples
+
+    def _crossfade(self, outgoing, incoming, sample_width):
+        # Linear equal-gain crossfade over interleaved samples; 8-bit samples are centred on 128.
+        n = len(outgoing); offset = 128 if sample_width == 1 else 0
+        if NUMPY_AVAILABLE:
+            weights = np.arange(n) / n
+            mixed = (np.frombuffer(outgoing, dtype=_NUMPY_TYPES[sample_width]).astype(np.float64) - offset) * (1.0 - weights) + (np.frombuffer(incoming, dtype=_NUMPY_TYPES[sample_width]).astype(np.float64) - offset) * weights
+            return self._to_array(mixed, offset, outgoing.typecode, sample_width)
+        return array(outgoing.typecode, (int((a - offset) * (1.0 - i / n) + (b - offset) * (i / n)) + offset for i, (a, b) in enumerate(zip(outgoing, incoming))))
+
+    def _ramp(self, samples, sample_width, fade_in):
+        n = len(samples); offset = 128 if sample_width == 1 else 0
+        if NUMPY_AVAILABLE:
+            weights = np.arange(n) / n
+            ramped = (np.frombuffer(samples, dtype=_NUMPY_TYPES[sample_width]).astype(np.float64) - offset) * (weights if fade_in else 1.0 - weights)
+            return self._to_array(ramped, offset, samples.typecode, sample_width)
+        return array(samples.typecode, (int((s - offset) * (i / n if fade_in else 1.0 - i / n)) + offset for i, s in enumerate(samples)))
+
+    def _to_array(self, values, offset, typecode, sample_width):
+        result = array(typecode); result.frombytes((np.trunc(values) + offset).astype(_NUMPY_TYPES[sample_width]).tobytes())
+        return result
+
+class SoundCompactor:
+    # Downmixes and resamples library WAVs to a smaller deployment format (mono 22.05 kHz by default), so every route's
+    # SOUND folder holds a fraction of the full-fidelity audio. Converted files are cached by source hash and format.
+    def __init__(self, cache_dir="compact_sounds", channels=1, frame_rate=22050, log_callback=print):
+        self.cache_dir = Path(cache_dir); self.channels = channels; self.frame_rate = frame_rate; self.log = log_callback
+
+    @property
+    def format_tag(self):
+        return f"{'m' if self.channels == 1 else f'{self.channels}ch'}{self.frame_rate // 1000}"
+
+    def convert(self, source_path, source_hash):
+        # Returns the compact copy of source_path, or source_path itself when it is already no larger than the target format.
+        source_path = Path(source_path)
+        target = self.cache_dir / f"COMPACT_{source_hash[:16]}_{self.format_tag}.wav"
+        if target.is_file(): return target
+        tmp_path = target.with_name(target.name + ".tmp")
+        try:
+            with contextlib.closing(wave.open(str(source_path), 'rb')) as f:
+                channels, sample_width, frame_rate = f.getnchannels(), f.getsampwidth(), f.getframerate()
+                if sample_width not in _SAMPLE_TYPES or (channels <= self.channels and frame_rate <= self.frame_rate): return source_path
+                data = f.readframes(f.getnframes())
+            samples = array(_SAMPLE_TYPES[sample_width]); samples.frombytes(data[:len(data) - len(data) % samples.itemsize])
+            if samples.itemsize != sample_width: return source_path
+            out_channels = min(channels, self.channels); out_rate = min(frame_rate, self.frame_rate)
+            converted = self._convert_samples(samples, sample_width, channels, out_channels, frame_rate, out_rate)
+            self.cache_dir.mkdir(exist_ok=True)
+            with contextlib.closing(wave.open(str(tmp_path), 'wb')) as out:
+                out.setnchannels(out_channels); out.setsampwidth(sample_width); out.setframerate(out_rate)
+                out.writeframes(converted.tobytes())
+            os.replace(tmp_path, target)
+        except (OSError, wave.Error, EOFError) as e:
+            self.log(f"[ERROR] Could not compact sound '{source_path.name}': {e}")
+            try: tmp_path.unlink()
+            except OSError: pass
+            return source_path
+        return target
+
+    def _convert_samples(self, samples, sample_width, channels, out_channels, frame_rate, out_rate):
+        # Downmix by averaging channels (all to mono, or keeping the first out_channels), then resample by averaging the
+        # input frames that fall in each output frame; the box average doubles as a crude anti-aliasing filter.
+        offset = 128 if sample_width == 1 else 0
+        frames = len(samples) // channels; step = frame_rate / out_rate
+        out_frames = int(frames / step)
+        bounds = [int(i * step) for i in range(out_frames + 1)]
+        if NUMPY_AVAILABLE:
+            data = np.frombuffer(samples, dtype=_NUMPY_TYPES[sample_width])[:frames * channels].astype(np.float64).reshape(frames, channels) - offset
+            data = data.mean(axis=1, keepdims=True) if out_channels == 1 else data[:, :out_channels]
+            sums = np.vstack([np.zeros((1, out_channels)), np.cumsum(data, axis=0)])
+            edges = np.array(bounds)
+            mixed = (sums[edges[1:]] - sums[edges[:-1]]) / (edges[1:] - edges[:-1])[:, None]
+            result = array(samples.typecode); result.frombytes((np.round(mixed) + offset).astype(_NUMPY_TYPES[sample_width]).tobytes())
+            return result
+        if out_channels == 1: streams = [[sum(frame) / channels - offset for frame in zip(*(samples[c::channels] for c in range(channels)))]]
+        else: streams = [[s - offset for s in samples[c::channels][:frames]] for c in range(out_channels)]
+        resampled = []
+        for stream in streams:
+            sums = [0.0]; sums.extend(accumulate(stream))
+            resampled.append([(sums[b] - sums[a]) / (b - a) for a, b in zip(bounds, bounds[1:])])
+        return array(samples.typecode, (int(round(value)) + offset for frame in zip(*resampled) for value in frame))
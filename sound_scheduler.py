@@ -0,0 +1,87 @@
+# sound_scheduler.py
+import random
+import time
+
+class SoundChannelScheduler:
+    # Places sounds on one channel per category while its condition holds. Intervals are fed in time order; adjacent
+    # intervals for the same category merge, so a continuous channel (rain, wind) is filled back to back across them
+    # and a sporadic one (thunder) gets one sound per spacing window. Each feed only schedules up to its own end.
+    # continuous_per_feed caps the clips a continuous channel starts per feed (None fills the whole interval).
+    def __init__(self, sound_definitions, playlist_for, rng=None, jitter=0, sporadic_spacing=1800, continuous_per_feed=None):
+        self.playlist_for = playlist_for; self.rng = rng or random.Random(); self.jitter = jitter; self.sporadic_spacing = sporadic_spacing
+        self.continuous_per_feed = continuous_per_feed
+        self.definitions_by_category = {}; self.categories_by_condition = {}
+        for definition in sound_definitions:
+            category = definition.get('category')
+            if not category or category in self.definitions_by_category: continue
+            self.definitions_by_category[category] = definition
+            self.categories_by_condition.setdefault(definition.get('condition'), []).append(category)
+        self._open = {} # Category -> end of its currently open (merged) interval
+        self._channel_end = {}; self._next_slot = {}; self._playlists = {}
+
+    def categories_for(self, conditions):
+        return [category for condition in conditions for category in self.categories_by_condition.get(condition, ())]
+
+    def is_sporadic(self, category):
+        return self.definitions_by_category[category].get('condition') == 'thunderstorm'
+
+    def feed(self, start, end, categories):
+        # Schedules [start, end) for the given categories and returns [(time, category, sound_info)] in time order.
+        scheduled = []
+        for category in categories:
+            if category not in self.definitions_by_category: continue
+            newly_open = self._open.get(category) != start
+            self._open[category] = end
+            if self.is_sporadic(category): self._fill_sporadic(category, start, end, newly_open, scheduled)
+            else: self._fill_continuous(category, start, end, newly_open, scheduled)
+        for category in [c for c in self._open if c not in categories]: del self._open[category]
+        scheduled.sort(key=lambda s: s[0])
+        return scheduled
+
+    def _next_sound(self, category):
+        playlist = self._playlists.get(category)
+        if not playlist:
+            sounds = self.playlist_for(category)
+            if not sounds: return None
+            playlist = self._playlists[category] = self.rng.sample(sorted(sounds, key=lambda s: str(s['path'])), len(sounds))
+        return playlist.pop()
+
+    def _fill_continuous(self, category, start, end, newly_open, scheduled):
+        current = max(self._channel_end.get(category, start), start + (self.rng.randint(1, self.jitter) if newly_open and self.jitter else 0))
+        placed = 0
+        while current < end and (self.continuous_per_feed is None or placed < self.continuous_per_feed):
+            sound = self._next_sound(category)
+            if not sound or sound['duration'] <= 0: break
+            scheduled.append((current, category, sound)); current += sound['duration']; placed += 1
+        self._channel_end[category] = current
+
+    def _fill_sporadic(self, category, start, end, newly_open, scheduled):
+        slot = start if newly_open else self._next_slot.get(category, start)
+        while slot < end:
+            window_end = min(slot + self.sporadic_spacing, end)
+            sound = self._next_sound(category)
+            if not sound: break
+            latest = int(window_end - sound['duration'])
+            if latest >= slot:
+                position = self.rng.randint(int(slot), latest)
+                if position >= self._channel_end.get(category, start):
+                    scheduled.append((position, category, sound)); self._channel_end[category] = position + sound['duration']
+            slot += self.sporadic_spacing
+        self._next_slot[category] = slot
+
+def benchmark_week(interval_secs=1800, repeat=3):
+    # Micro-benchmark: schedules a week of alternating rain/wind/thunder conditions.
+    definitions = [{'category': 'rain', 'condition': 'light_rain'}, {'category': 'wind', 'condition': 'windy'}, {'category': 'thunder', 'condition': 'thunderstorm'}]
+    sounds = {c['category']: [{'path': f"{c['category']}_{i}.wav", 'duration': 20 + 7 * i} for i in range(8)] for c in definitions}
+    condition_cycle = [{'light_rain'}, {'light_rain', 'windy'}, {'windy'}, {'light_rain', 'thunderstorm'}, set()]
+    intervals = [(t, t + interval_secs, condition_cycle[(t // (6 * 3600)) % len(condition_cycle)]) for t in range(0, 7 * 86400, interval_secs)]
+    best = None
+    for _ in range(repeat):
+        scheduler = SoundChannelScheduler(definitions, sounds.get, random.Random(1), jitter=5)
+        start = time.perf_counter(); count = sum(len(scheduler.feed(s, e, scheduler.categories_for(c))) for s, e, c in intervals); elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"Scheduled {count} sounds over {len(intervals)} intervals (one week) in {best * 1000:.1f} ms")
+    return best
+
+if __name__ == "__main__":
+    benchmark_week()
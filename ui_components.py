@@ -193,11 +193,29 @@ class SettingsWindow(tk.Toplevel):
         transition_spinbox = ttk.Spinbox(weather_settings_frame, from_=60, to=7200, increment=60, textvariable=self.transition_var, command=self.save_transition_time, width=8)
         transition_spinbox.grid(row=0, column=1, sticky="w")
         Tooltip(transition_spinbox, "How long each weather change should take. Recommended: 1800 (for 30-minute intervals).")
+        ttk.Label(weather_settings_frame, text="Activity Duration (hours):").grid(row=1, column=0, sticky="w", padx=5)
+        self.duration_var = tk.IntVar(value=self.config.get('generation_hours'))
+        duration_spinbox = ttk.Spinbox(weather_settings_frame, from_=1, to=168, increment=1, textvariable=self.duration_var, command=self.save_generation_timeline, width=8)
+        duration_spinbox.grid(row=1, column=1, sticky="w")
+        Tooltip(duration_spinbox, "How many hours of weather to generate from the activity start. Multi-day activities are supported.")
+        ttk.Label(weather_settings_frame, text="Weather Interval (minutes):").grid(row=2, column=0, sticky="w", padx=5)
+        self.interval_var = tk.IntVar(value=self.config.get('weather_interval_mins'))
+        interval_spinbox = ttk.Spinbox(weather_settings_frame, from_=5, to=180, increment=5, textvariable=self.interval_var, command=self.save_generation_timeline, width=8)
+        interval_spinbox.grid(row=2, column=1, sticky="w")
+        Tooltip(interval_spinbox, "Time between generated weather changes.")
 
 
         sound_frame = ttk.LabelFrame(general_frame, text="Sound System", padding=10)
         sound_frame.pack(fill="x", pady=(10,0))
-        ttk.Button(sound_frame, text="Rescan `user_sounds` Folder", command=self.parent.sound_manager.discover_sounds).pack(fill="x")
+        ttk.Button(sound_frame, text="Rescan `user_sounds` Folder", command=self.parent.sound_manager.rescan).pack(fill="x")
+        self.compact_var = tk.BooleanVar(value=self.config.get('compact_sounds'))
+        compact_check = ttk.Checkbutton(sound_frame, text="Deploy compact sounds (mono, 22 kHz)", variable=self.compact_var, command=self.save_compact_setting)
+        compact_check.pack(anchor="w", pady=(5,0))
+        Tooltip(compact_check, "Downmixes and resamples sounds as they are copied to a route, greatly reducing the space they take in each SOUND folder.")
+        self.loops_var = tk.BooleanVar(value=self.config.get('render_ambient_loops'))
+        loops_check = ttk.Checkbutton(sound_frame, text="Render long ambient loops", variable=self.loops_var, command=self.save_loops_setting)
+        loops_check.pack(anchor="w", pady=(5,0))
+        Tooltip(loops_check, "Stitches short ambient clips into 15-minute loops, so far fewer sound events are written. Each loop can take well over 100 MB in every route it is deployed to.")
 
         reset_frame = ttk.LabelFrame(general_frame, text="Application Reset", padding=10)
         reset_frame.pack(fill="x", pady=(10,0))
@@ -221,12 +239,22 @@ class SettingsWindow(tk.Toplevel):
         cleanup_lf = ttk.LabelFrame(paths_frame, text="Cleanup Operations", padding=10)
         cleanup_lf.pack(fill="x", pady=(10,0))
         ttk.Button(cleanup_lf, text="Clean All Added Files from ALL Content Folders...", command=self.parent.run_global_cleanup).pack(fill="x")
+        verify_button = ttk.Button(cleanup_lf, text="Rescan Content Folders for Generated Files", command=self.parent.run_generated_files_verify); verify_button.pack(fill="x", pady=(5,0))
+        Tooltip(verify_button, "Rebuilds the list of files created by WeatherLink from what is actually on disk. Use this if files were added or removed outside the application.")
 
         ttk.Button(self, text="Close", command=self.destroy).pack(pady=(0,10))
 
     def save_cache_setting(self):
         self.config.set('use_route_cache', self.cache_var.get())
 
+    def save_compact_setting(self):
+        self.config.set('compact_sounds', self.compact_var.get())
+        self.parent.sound_manager.compact_sounds = self.compact_var.get()
+
+    def save_loops_setting(self):
+        self.config.set('render_ambient_loops', self.loops_var.get())
+        self.parent.sound_manager.render_ambient_loops = self.loops_var.get()
+
     def confirm_and_reset_settings(self):
         msg = "This will reset all application settings (like theme and pin distance) to their original defaults. Your Content Folders list will not be affected.\n\nAre you sure you want to continue?"
         if messagebox.askyesno("Confirm Reset", msg, icon='warning', parent=self):
@@ -235,6 +263,10 @@ class SettingsWindow(tk.Toplevel):
             self.pin_distance_var.set(self.config.get('pin_distance_km'))
             self.cache_var.set(self.config.get('use_route_cache'))
             self.transition_var.set(self.config.get('weather_transition_secs'))
+            self.duration_var.set(self.config.get('generation_hours'))
+            self.interval_var.set(self.config.get('weather_interval_mins'))
+            self.compact_var.set(self.config.get('compact_sounds')); self.parent.sound_manager.compact_sounds = self.config.get('compact_sounds')
+            self.loops_var.set(self.config.get('render_ambient_loops')); self.parent.sound_manager.render_ambient_loops = self.config.get('render_ambient_loops')
             self.apply_theme()
             self.parent.geometry(self.config.get('window_geometry'))
             messagebox.showinfo("Success", "Settings have been reset to default.", parent=self)
@@ -253,6 +285,13 @@ class SettingsWindow(tk.Toplevel):
         except (tk.TclError, ValueError):
             pass # Ignore errors from spinbox during input
 
+    def save_generation_timeline(self):
+        try:
+            self.config.set('generation_hours', self.duration_var.get())
+            self.config.set('weather_interval_mins', self.interval_var.get())
+        except (tk.TclError, ValueError):
+            pass # Ignore errors from spinbox during input
+
     def apply_theme(self):
         theme = self.theme_var.get()
         sv_ttk.set_theme(theme)
@@ -0,0 +1,93 @@
+# weather_events.py
+import re
+import time
+
+# Every Open Rails parameter WeatherLink reads from an EventCategoryTime block, matched in one pass.
+_EVENT_FIELD_PATTERN = re.compile(r'\bORTSWeatherChange\s*\(|\b(ID|Name|Time|ORTSOvercast|ORTSFog|ORTSPrecipitationIntensity|ORTSPrecipitationLiquidity)\s*\(\s*(?:"([^"]*)"|([^\s()"]+))(?:\s+([\d\.-]+))?', re.IGNORECASE)
+_WEATHER_FIELDS = {"ortsovercast": "overcast", "ortsfog": "fog", "ortsprecipitationintensity": "precip", "ortsprecipitationliquidity": "liquidity"}
+
+class WeatherChange:
+    # One ORTSWeatherChange event in Open Rails units: overcast and liquidity 0-1, fog in metres,
+    # precipitation intensity as written in the .act. Parameters missing from the block are None.
+    __slots__ = ("event_id", "name", "time", "overcast", "fog", "precip", "liquidity",
+                 "overcast_transition", "fog_transition", "precip_transition", "liquidity_transition")
+
+    def __init__(self, time=0, name=None, event_id=None, overcast=None, fog=None, precip=None, liquidity=None, transition=None):
+        self.event_id = event_id; self.name = name; self.time = time
+        self.overcast = overcast; self.fog = fog; self.precip = precip; self.liquidity = liquidity
+        self.overcast_transition = self.fog_transition = self.precip_transition = self.liquidity_transition = transition
+
+    @property
+    def transition(self):
+        for value in (self.overcast_transition, self.fog_transition, self.precip_transition, self.liquidity_transition):
+            if value is not None: return value
+        return None
+
+    def render(self):
+        params = []
+        if self.overcast is not None: params.append(f"ORTSOvercast ( {self.overcast:.2f} {self.overcast_transition or 0} )")
+        if self.fog is not None: params.append(f"ORTSFog ( {self.fog:.0f} {self.fog_transition or 0} )")
+        if self.precip is not None: params.append(f"ORTSPrecipitationIntensity ( {self.precip:.5f} {self.precip_transition or 0} )")
+        if self.liquidity is not None: params.append(f"ORTSPrecipitationLiquidity ( {self.liquidity:.1f} {self.liquidity_transition or 0} )")
+        return f"EventCategoryTime ( ID ( {self.event_id} ) Name ( {self.name} ) Time ( {int(self.time)} ) Outcomes ( ORTSWeatherChange ( {' '.join(params)} ) ) )"
+
+    def to_editor_dict(self):
+        # Values in the units the manual editor's table uses (overcast %, precipitation mm/h).
+        transition = self.transition
+        return {'type': 'weather', 'time': self.time or 0, 'overcast': (self.overcast or 0.0) * 100, 'fog': self.fog or 0.0,
+                'precip': (self.precip or 0.0) * 1000, 'liquidity': self.liquidity or 0.0, 'transition': 30 if transition is None else transition}
+
+class ActivitySound:
+    # One ORTSActivitySound event. sound_file is the path as written in the .act (relative to the activity).
+    __slots__ = ("event_id", "name", "time", "sound_file", "sound_type")
+
+    def __init__(self, time, sound_file, sound_type, name=None, event_id=None):
+        self.event_id = event_id; self.name = name; self.time = time
+        self.sound_file = sound_file; self.sound_type = sound_type
+
+    def render(self):
+        return f"EventCategoryTime ( ID ( {self.event_id} ) Name ( {self.name} ) Time ( {int(self.time)} ) Outcomes ( ORTSActivitySound ( ORTSActSoundFile ( \"{self.sound_file}\" {self.sound_type} ) ) ) )"
+
+def iter_event_lines(events, indent="\t\t"):
+    # Renders events lazily, one line each (no trailing newline), for writers that stream into the .act.
+    for event in events: yield indent + event.render()
+
+def serialize_events(events, indent="\t\t"):
+    return "\n".join(iter_event_lines(events, indent))
+
+def parse_weather_event(block):
+    # Parses one EventCategoryTime/EventTypeTime block. Returns None if it carries no ORTSWeatherChange; the event's
+    # time is None if the block has no Time.
+    event = WeatherChange(time=None); has_weather = False
+    for m in _EVENT_FIELD_PATTERN.finditer(block):
+        if m.group(1) is None: has_weather = True; continue
+        key = m.group(1).lower(); value = m.group(2) if m.group(2) is not None else m.group(3)
+        if key == "time":
+            if value and value.isdigit(): event.time = int(value)
+        elif key == "name": event.name = value.strip() if value else None
+        elif key == "id":
+            if value and value.isdigit(): event.event_id = int(value)
+        else:
+            field = _WEATHER_FIELDS[key]
+            try: setattr(event, field, float(value))
+            except (TypeError, ValueError): continue
+            if m.group(4):
+                try: setattr(event, field + "_transition", int(float(m.group(4))))
+                except ValueError: pass
+    return event if has_weather else None
+
+def benchmark_extraction(event_count=5000, repeat=3):
+    # Micro-benchmark: times parse_weather_event over a synthetic activity with event_count events.
+    blocks = [f"\t\tEventCategoryTime ( ID ( 900{i} ) Name ( WTHLINK_Interval_{i} ) Time ( {i * 1800} ) Outcomes ( ORTSWeatherChange ( ORTSOvercast ( 0.{i % 100:02d} 60 ) ORTSFog ( {1000 + i} 60 ) ORTSPrecipitationIntensity ( 0.00{i % 10}00 60 ) ORTSPrecipitationLiquidity ( 1.0 60 ) ) ) )" for i in range(event_count)]
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter(); parsed = [parse_weather_event(b) for b in blocks]; elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    assert all(parsed)
+    print(f"Parsed {event_count} weather events in {best * 1000:.1f} ms ({best / event_count * 1e6:.2f} us/event)")
+    start = time.perf_counter(); serialize_events(parsed); elapsed = time.perf_counter() - start
+    print(f"Serialized {event_count} weather events in {elapsed * 1000:.1f} ms")
+    return best
+
+if __name__ == "__main__":
+    benchmark_extraction()
@@ -8,8 +8,16 @@ from pathlib import Path
 from tkinter import simpledialog, messagebox
 import xml.etree.ElementTree as ET
 import re
+import os
+import hashlib
+import sqlite3
+from weather_events import WeatherChange, ActivitySound, serialize_events
+from sound_scheduler import SoundChannelScheduler
+from preset_store import PresetStore
 
 class WeatherService:
+    GENERATION_CACHE_SIZE = 32
+
     def __init__(self, log_callback=print):
         self.log = log_callback
         self.WMO_CODES = {
@@ -26,8 +34,10 @@ class WeatherService:
         self.HEAVY_RAIN_MMH = 7.6
         self.current_forecast_data = None
         self.last_location_name = "Forecast"
+        self.generation_cache_dir = Path("generation_cache")
+        self.preset_store = PresetStore(log_callback=log_callback)
 
-    def get_weather_data(self, weather_points, date_obj=None):
+    def get_weather_data(self, weather_points, date_obj=None, days=2):
         if not weather_points:
             self.log("[ERROR] get_weather_data called with no coordinates.")
             return None
@@ -69,11 +79,11 @@ class WeatherService:
                 base_url = "https://api.open-meteo.com/v1/forecast"
             
             date_str = date_obj.strftime("%Y-%m-%d")
-            next_day = (date_obj + timedelta(days=1)).strftime("%Y-%m-%d")
+            last_day = (date_obj + timedelta(days=max(1, days - 1))).strftime("%Y-%m-%d")
             params["start_date"] = date_str
-            params["end_date"] = next_day
+            params["end_date"] = last_day
         else: # Default live weather forecast
-            params["forecast_days"] = 2
+            params["forecast_days"] = max(2, days)
 
         all_results = []
         for i, coords in enumerate(weather_points):
@@ -123,92 +133,141 @@ class WeatherService:
             if month in [3, 4, 5]: return 2 # Autumn
             return 3 # Winter
             
-    def create_weather_events_string(self, path_coords, path_dist, season, date_obj, start_hour, add_thunder_sounds, add_wind_sounds, add_rain_sounds, sound_manager, route_path, transition_secs):
+    def build_weather_events(self, path_coords, path_dist, season, date_obj, start_hour, add_thunder_sounds, add_wind_sounds, add_rain_sounds, sound_manager, route_path, transition_secs, duration_hours=24, interval_mins=30):
+        # Returns (events, message). Events are WeatherChange/ActivitySound records (or an already rendered block from
+        # the cache); every lookup and sound copy has happened by the time this returns, and the activity writer only
+        # streams their serialization.
+        interval_secs = max(60, int(interval_mins * 60))
+        total_intervals = max(1, int(duration_hours * 3600) // interval_secs)
+        days = max(2, math.ceil((start_hour * 3600 + total_intervals * interval_secs) / 86400))
         weather_points = [p[0] for p in path_coords] if path_coords else []
-        weather_data_list = self.get_weather_data(weather_points, date_obj)
+
+        weather_data_list = self.get_weather_data(weather_points, date_obj, days=days)
         if not weather_data_list: return None, "Could not fetch weather data from API."
-        
-        def map_weather(wmo, cloud, precip, vis, temp):
-            params = {"Overcast": 0.0, "Fog": 100000.0, "Precipitation": 0.0, "Liquidity": 1.0}
-            if cloud is not None: params["Overcast"] = round(cloud / 100.0, 2)
-            if precip is not None: params["Precipitation"] = round(min(precip, 15.0) / 1000.0, 5)
-            if vis is not None: params["Fog"] = max(10, vis)
-            
-            if wmo in self.SNOW_WMO_CODES:
-                params["Liquidity"] = 0.0
-            elif temp is not None:
-                if temp > 2: liquidity = 1.0
-                elif temp < -1: liquidity = 0.0
-                else: liquidity = (temp + 1) / 3.0
-                params["Liquidity"] = round(max(0.0, min(1.0, liquidity)), 2)
-            else:
-                params["Liquidity"] = 1.0
+        if not any(data.get("hourly") for data in weather_data_list): return None, "Incomplete weather data from API. Error: no hourly data."
 
-            if wmo is not None and 45 <= wmo <= 48:
-                params["Fog"] = int(min(params["Fog"], 600)); params["Overcast"] = max(params["Overcast"], 0.8)
-            return params
-            
-        events = []; sound_events = []; sound_channels = {}; sound_playlists = {}; global_sound_counter = 0
-        num_locations = len(weather_data_list)
-        total_intervals = 48
-        start_time_of_day_secs = start_hour * 3600
+        # The fetched forecast is part of the key, so a revised forecast (e.g. a later live refresh) is never served stale.
+        forecast_hash = hashlib.sha256(json.dumps(weather_data_list, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        generation_key = self._generation_key(weather_points=[(round(lat, 6), round(lon, 6)) for lat, lon in weather_points], date=date_obj.isoformat() if date_obj else None,
+                                              start_hour=start_hour, add_thunder_sounds=add_thunder_sounds, add_wind_sounds=add_wind_sounds, add_rain_sounds=add_rain_sounds,
+                                              sound_library=sound_manager.library_signature(), transition_secs=transition_secs, total_intervals=total_intervals,
+                                              interval_secs=interval_secs, forecast=forecast_hash)
+        cached = self._load_generation(generation_key)
+        if cached:
+            # Only reuse the block if every sound it references is back in the route; otherwise build it afresh.
+            if all(sound_manager.copy_sound_to_route(Path(sound_path), route_path) for sound_path in cached["sounds"]):
+                self.log(f"[Info] Reusing cached weather timeline for identical inputs ({generation_key[:12]}).")
+                return cached["events"], f"Weather timeline served from cache: {total_intervals} intervals of {interval_secs // 60} min."
+            self.log("[WARN] A cached weather timeline's sounds could not be redeployed; generating it again.")
+
+        # Seeded from the inputs, so the same request always schedules the same sounds.
+        rng = random.Random(int(generation_key[:16], 16)); deployed_sounds = []
+        try:
+            samples = self._sample_intervals(weather_data_list, start_hour, total_intervals, interval_secs)
+            mapped = self._map_intervals(samples, transition_secs, add_thunder_sounds, add_wind_sounds, add_rain_sounds)
+            events = list(self._schedule_sounds(mapped, sound_manager, route_path, interval_secs, rng, deployed_sounds))
+        except (IndexError, KeyError, TypeError, ValueError) as e: return None, f"Incomplete weather data from API. Error: {e}"
+        self._record_generation(events, generation_key, deployed_sounds)
+        return events, f"Weather timeline prepared: {total_intervals} intervals of {interval_secs // 60} min."
+
+    def _generation_key(self, **inputs):
+        # Keyword-only, so an input can never shift into another's slot; the names are part of the hashed payload.
+        payload = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
+    def _load_generation(self, key):
         try:
-            for i in range(total_intervals):
-                location_index = min(int((i / total_intervals) * num_locations), num_locations - 1)
-                hourly = weather_data_list[location_index].get("hourly", {})
-                
-                current_hour_idx = start_hour + (i // 2)
-                def get_val(param):
-                    if not hourly or not hourly.get(param) or current_hour_idx >= len(hourly[param]): return 0
-                    val_current = hourly[param][current_hour_idx] if hourly[param][current_hour_idx] is not None else 0
-                    val_next_idx = current_hour_idx + 1
-                    if val_next_idx >= len(hourly[param]): val_next = val_current
-                    else: val_next = hourly[param][val_next_idx] if hourly[param][val_next_idx] is not None else val_current
-                    return (val_current + val_next) / 2.0 if (i % 2 == 1) else val_current
+            with open(self.generation_cache_dir / f"{key}.json", 'r', encoding='utf-8') as f: return json.load(f)
+        except (OSError, json.JSONDecodeError): return None
 
-                wmo = int(get_val("weathercode")); temp = get_val("temperature_2m"); wind_speed = get_val("windspeed_10m"); precip_mm = get_val("precipitation")
-                p = map_weather(wmo, get_val("cloudcover"), precip_mm, get_val("visibility"), temp)
-                
-                event_time_offset = i * 1800 # 30 minute intervals
-                event_time_seconds = start_time_of_day_secs + event_time_offset
-                
-                # Make the first event's transition time short, subsequent ones use the user setting.
-                current_transition_time = 60 if i == 0 else transition_secs
-                
-                event_lines = [ f"\t\tEventCategoryTime ( ID ( 900{i} ) Name ( WTHLINK_Interval_{i} ) Time ( {event_time_seconds} ) Outcomes ( ORTSWeatherChange ( ORTSOvercast ( {p['Overcast']:.2f} {current_transition_time} ) ORTSFog ( {p['Fog']:.0f} {current_transition_time} ) ORTSPrecipitationIntensity ( {p['Precipitation']:.5f} {current_transition_time} ) ORTSPrecipitationLiquidity ( {p['Liquidity']:.1f} {current_transition_time} ) ) ) )" ]
-                events.extend(event_lines)
+    def _record_generation(self, events, key, deployed_sounds):
+        # Stores the rendered block and the sounds it needs, for identical requests to reuse.
+        try:
+            self.generation_cache_dir.mkdir(exist_ok=True)
+            tmp_path = self.generation_cache_dir / f"{key}.json.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"events": serialize_events(events), "sounds": sorted({str(p) for p in deployed_sounds})}, f)
+            os.replace(tmp_path, self.generation_cache_dir / f"{key}.json")
+            entries = sorted(self.generation_cache_dir.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+            for stale in entries[self.GENERATION_CACHE_SIZE:]: stale.unlink()
+        except OSError as e: self.log(f"[WARN] Could not cache generated weather timeline: {e}")
+
+    def _map_weather(self, wmo, cloud, precip, vis, temp):
+        params = {"Overcast": 0.0, "Fog": 100000.0, "Precipitation": 0.0, "Liquidity": 1.0}
+        if cloud is not None: params["Overcast"] = round(cloud / 100.0, 2)
+        if precip is not None: params["Precipitation"] = round(min(precip, 15.0) / 1000.0, 5)
+        if vis is not None: params["Fog"] = max(10, vis)
+        
+        if wmo in self.SNOW_WMO_CODES:
+            params["Liquidity"] = 0.0
+        elif temp is not None:
+            if temp > 2: liquidity = 1.0
+            elif temp < -1: liquidity = 0.0
+            else: liquidity = (temp + 1) / 3.0
+            params["Liquidity"] = round(max(0.0, min(1.0, liquidity)), 2)
+        else:
+            params["Liquidity"] = 1.0
+
+        if wmo is not None and 45 <= wmo <= 48:
+            params["Fog"] = int(min(params["Fog"], 600)); params["Overcast"] = max(params["Overcast"], 0.8)
+        return params
+
+    def _sample_intervals(self, weather_data_list, start_hour, total_intervals, interval_secs):
+        # Yields (interval, event time, hourly values interpolated at that time) along the route's weather points.
+        num_locations = len(weather_data_list)
+        for i in range(total_intervals):
+            location_index = min(int((i / total_intervals) * num_locations), num_locations - 1)
+            hourly = weather_data_list[location_index].get("hourly", {})
+            offset_hours = start_hour + i * interval_secs / 3600.0
+            current_hour_idx = int(offset_hours); fraction = offset_hours - current_hour_idx
+            def get_val(param):
+                if not hourly or not hourly.get(param) or current_hour_idx >= len(hourly[param]): return 0
+                val_current = hourly[param][current_hour_idx] if hourly[param][current_hour_idx] is not None else 0
+                val_next_idx = current_hour_idx + 1
+                if val_next_idx >= len(hourly[param]): val_next = val_current
+                else: val_next = hourly[param][val_next_idx] if hourly[param][val_next_idx] is not None else val_current
+                return val_current * (1 - fraction) + val_next * fraction if fraction else val_current
+            sample = {name: get_val(name) for name in ("weathercode", "temperature_2m", "windspeed_10m", "precipitation", "cloudcover", "visibility")}
+            yield i, start_hour * 3600 + i * interval_secs, sample
 
-                conditions = set()
-                if add_wind_sounds and p['Liquidity'] < 0.2 and precip_mm >= self.BLIZZARD_PRECIP_MMH and wind_speed > self.WINDY_THRESHOLD_KMH: conditions.add("blizzard")
-                elif add_wind_sounds and wind_speed > self.WINDY_THRESHOLD_KMH: conditions.add("windy")
-                
-                if add_rain_sounds and p['Liquidity'] > 0.5:
-                    if precip_mm >= self.HEAVY_RAIN_MMH: conditions.add("heavy_rain")
-                    elif precip_mm >= self.MEDIUM_RAIN_MMH: conditions.add("medium_rain")
-                    elif precip_mm >= self.LIGHT_RAIN_MMH: conditions.add("light_rain")
-                
-                if add_thunder_sounds and wmo in self.THUNDERSTORM_CODES: conditions.add("thunderstorm")
+    def _map_intervals(self, samples, transition_secs, add_thunder_sounds, add_wind_sounds, add_rain_sounds):
+        # Yields (interval, event time, WeatherChange, sound conditions active during that interval).
+        for i, event_time_seconds, sample in samples:
+            wmo = int(sample["weathercode"]); precip_mm = sample["precipitation"]; wind_speed = sample["windspeed_10m"]
+            p = self._map_weather(wmo, sample["cloudcover"], precip_mm, sample["visibility"], sample["temperature_2m"])
+            # Make the first event's transition time short, subsequent ones use the user setting.
+            current_transition_time = 60 if i == 0 else transition_secs
+            event = WeatherChange(event_time_seconds, f"WTHLINK_Interval_{i}", int(f"900{i}"), p['Overcast'], p['Fog'], p['Precipitation'], p['Liquidity'], current_transition_time)
 
-                for sound_def in sound_manager.sound_definitions:
-                    category = sound_def['category']
-                    if sound_def['condition'] in conditions:
-                        sound_channels.setdefault(category, start_time_of_day_secs)
-                        if event_time_seconds >= sound_channels[category]:
-                            if not sound_playlists.get(category):
-                                all_sounds = sound_manager.sounds.get(category, [])
-                                if all_sounds: sound_playlists[category] = random.sample(all_sounds, len(all_sounds))
-                            
-                            if sound_playlists.get(category):
-                                sound_info = sound_playlists[category].pop()
-                                schedule_time = max(sound_channels[category], event_time_seconds + random.randint(1, 5)) if sound_def['condition'] != 'thunderstorm' else event_time_seconds + random.randint(10, 900)
-                                sound_filename_in_act = sound_manager.copy_sound_to_route(sound_info['path'], route_path)
-                                if sound_filename_in_act:
-                                    sound_events.extend([f"\t\tEventCategoryTime ( ID ( 9{global_sound_counter} ) Name ( WTHLINK_{category}_{i}_{global_sound_counter} ) Time ( {schedule_time} ) Outcomes ( ORTSActivitySound ( ORTSActSoundFile ( \"{sound_filename_in_act}\" {sound_info['sound_type']} ) ) ) )"])
-                                    global_sound_counter += 1
-                                    sound_channels[category] = schedule_time + sound_info['duration']
-        except (IndexError, KeyError) as e: return None, f"Incomplete weather data from API. Error: {e}"
-        return "\n".join(events + sound_events), "Weather and sound events generated successfully."
+            conditions = set()
+            if add_wind_sounds and p['Liquidity'] < 0.2 and precip_mm >= self.BLIZZARD_PRECIP_MMH and wind_speed > self.WINDY_THRESHOLD_KMH: conditions.add("blizzard")
+            elif add_wind_sounds and wind_speed > self.WINDY_THRESHOLD_KMH: conditions.add("windy")
+            
+            if add_rain_sounds and p['Liquidity'] > 0.5:
+                if precip_mm >= self.HEAVY_RAIN_MMH: conditions.add("heavy_rain")
+                elif precip_mm >= self.MEDIUM_RAIN_MMH: conditions.add("medium_rain")
+                elif precip_mm >= self.LIGHT_RAIN_MMH: conditions.add("light_rain")
+            
+            if add_thunder_sounds and wmo in self.THUNDERSTORM_CODES: conditions.add("thunderstorm")
+            yield i, event_time_seconds, event, conditions
+
+    def _schedule_sounds(self, mapped, sound_manager, route_path, interval_secs, rng=random, deployed_sounds=None):
+        # Yields each interval's weather change followed by the sounds that start in it.
+        def playlist_for(category):
+            return sound_manager.sounds.get(category, []) if scheduler.is_sporadic(category) else sound_manager.ambient_playlist(category)
+        # At most one clip per channel per interval, as before the shared scheduler; filling every channel back to back
+        # with short clips would write thousands of sound events per day into the activity.
+        scheduler = SoundChannelScheduler(sound_manager.sound_definitions, playlist_for, rng, jitter=5, sporadic_spacing=interval_secs, continuous_per_feed=1)
+        global_sound_counter = 0
+        with sound_manager.generated.batch(): # One manifest write for all the sounds deployed by this generation
+            for i, event_time_seconds, event, conditions in mapped:
+                yield event
+                for schedule_time, category, sound_info in scheduler.feed(event_time_seconds, event_time_seconds + interval_secs, scheduler.categories_for(conditions)):
+                    sound_filename_in_act = sound_manager.copy_sound_to_route(sound_info['path'], route_path)
+                    if sound_filename_in_act:
+                        if deployed_sounds is not None: deployed_sounds.append(sound_info['path'])
+                        yield ActivitySound(schedule_time, sound_filename_in_act, sound_info['sound_type'], f"WTHLINK_{category}_{i}_{global_sound_counter}", int(f"9{global_sound_counter}"))
+                        global_sound_counter += 1
 
     def create_weather_from_metar(self, icao_code):
         self.log(f"[Info] Fetching METAR for {icao_code}...")
@@ -261,8 +320,8 @@ class WeatherService:
                     p["Fog"] = int(min(p["Fog"], 800))
                     p["Overcast"] = max(p["Overcast"], 0.9)
 
-            event = f"""\t\tEventCategoryTime ( ID ( 9000 ) Name ( WTHLINK_METAR_{icao_code} ) Time ( 0 ) Outcomes ( ORTSWeatherChange ( ORTSOvercast ( {p['Overcast']:.2f} 60 ) ORTSFog ( {p['Fog']:.0f} 60 ) ORTSPrecipitationIntensity ( {p['Precipitation']:.5f} 60 ) ORTSPrecipitationLiquidity ( {p['Liquidity']:.1f} 60 ) ) ) )"""
-            return event, f"Successfully created weather from METAR at {icao_code}."
+            event = WeatherChange(0, f"WTHLINK_METAR_{icao_code}", 9000, p['Overcast'], p['Fog'], p['Precipitation'], p['Liquidity'], 60)
+            return [event], f"Successfully created weather from METAR at {icao_code}."
             
         except requests.exceptions.RequestException as e:
             return None, f"Failed to fetch METAR data: {e}"
@@ -278,8 +337,8 @@ class WeatherService:
             precip = random.choice([0.0, random.uniform(0.1, 15.0)])
             liquidity = random.uniform(0.0, 1.0) if precip > 0 else 1.0
             transition = random.randint(15, 60)
-            events.append(f"""\t\tEventCategoryTime ( ID ( 900{i} ) Name ( WTHLINK_Chaotic_{i} ) Time ( {event_time} ) Outcomes ( ORTSWeatherChange ( ORTSOvercast ( {overcast:.2f} {transition} ) ORTSFog ( {int(fog)} {transition} ) ORTSPrecipitationIntensity ( {precip/1000.0:.5f} {transition} ) ORTSPrecipitationLiquidity ( {liquidity:.1f} {transition} ) ) ) )""")
-        return "\n".join(events), "Chaotic weather events generated for testing."
+            events.append(WeatherChange(event_time, f"WTHLINK_Chaotic_{i}", int(f"900{i}"), overcast, fog, precip / 1000.0, liquidity, transition))
+        return events, "Chaotic weather events generated for testing."
 
     def save_forecast_as_preset(self, parent_app):
         if not self.current_forecast_data:
@@ -301,21 +360,13 @@ class WeatherService:
             events.append((time, overcast, fog, precip, liquidity, 1800, "None"))
         
         season = self.get_season(datetime.now().date(), self.current_forecast_data[0]['latitude'])
-        new_preset = {"season": season, "events": events}
 
-        user_presets_path = Path("user_presets.json")
-        user_presets = {}
-        if user_presets_path.exists():
-            with open(user_presets_path, 'r') as f:
-                try: user_presets = json.load(f)
-                except json.JSONDecodeError: pass
-        
-        if preset_name in user_presets:
+        if preset_name in self.preset_store:
             if not messagebox.askyesno("Confirm Overwrite", "A preset with this name already exists. Overwrite it?", parent=parent_app):
                 return
         
-        user_presets[preset_name] = new_preset
-        with open(user_presets_path, 'w') as f:
-            json.dump(user_presets, f, indent=4)
+        try: self.preset_store.upsert(preset_name, season, events)
+        except sqlite3.Error as e:
+            messagebox.showerror("Error", f"Could not save preset.\n\n{e}", parent=parent_app); return
         
         messagebox.showinfo("Success", f"Preset '{preset_name}' saved successfully.", parent=parent_app)
\ No newline at end of file